@@ -1,10 +1,52 @@
 import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import concurrent.futures
+import torch
 from transformers import pipeline
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import classes
 import user_preferences
 from environment_variables import SENTIMENT_ANALYSIS_MODEL_DIR, SENTIMENT_ANALYSIS_MODEL_NAME
 
 
+# Inference runs on this single worker thread so that the event loop (and with it the Discord client) stays responsive
+#   while posts are classified. The model is also loaded on the worker, starting when the bot starts (see load_classifier)
+def _limit_torch_threads():
+    torch.set_num_threads(user_preferences.SENTIMENT_ANALYSIS_TORCH_THREADS)
+
+
+inference_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="sentiment_analysis", initializer=_limit_torch_threads)
+
+# Classification requests waiting for the worker, created on first use so that it is bound to the running event loop
+inference_queue = None
+inference_queue_worker = None
+inference_stats = {
+    "requests": 0,
+    "timeouts": 0,
+    "failures": 0,
+    "total_latency": 0.0,
+    "max_latency": 0.0,
+}
+
+tokenizer = None
+classifier = None
+# Future of loading the model on the inference worker, started when the bot starts (see load_classifier)
+classifier_load = None
+# Hash of the loaded model's configuration, set once the model is loaded
+model_version = None
+
+# Results of previously classified text, keyed by the model and a hash of the normalized text so that repeated text
+#   (copypasta, bot replies, re-fetched posts) is only classified once. If SENTIMENT_ANALYSIS_CACHE_FILE is set, results
+#   are also saved to that SQLite file so they are kept across restarts
+classification_cache = classes.TTLCache(user_preferences.SENTIMENT_ANALYSIS_CACHE_SIZE)
+classification_cache_connection = None
+persisted_classification_hits = 0
+
+
 def _save_model_to_disk(model_name_to_save):
     temp_tokenizer = AutoTokenizer.from_pretrained(model_name_to_save)
     temp_model = AutoModelForSequenceClassification.from_pretrained(model_name_to_save)
@@ -13,18 +55,225 @@ def _save_model_to_disk(model_name_to_save):
     temp_model.save_pretrained(SENTIMENT_ANALYSIS_MODEL_DIR)
 
 
-# Save model to disk if we don't have it (usually only done on first run)
-if not os.path.exists(SENTIMENT_ANALYSIS_MODEL_DIR):
-    _save_model_to_disk(SENTIMENT_ANALYSIS_MODEL_NAME)
+def _load_classifier():
+    global tokenizer
+    global classifier
+    global model_version
+    if classifier is None:
+        # Save model to disk if we don't have it (usually only done on first run)
+        if not os.path.exists(SENTIMENT_ANALYSIS_MODEL_DIR):
+            _save_model_to_disk(SENTIMENT_ANALYSIS_MODEL_NAME)
+
+        tokenizer = AutoTokenizer.from_pretrained(SENTIMENT_ANALYSIS_MODEL_DIR)
+        model = AutoModelForSequenceClassification.from_pretrained(SENTIMENT_ANALYSIS_MODEL_DIR)
+        classifier = pipeline("sentiment-analysis", tokenizer=tokenizer, model=model)
+        model_version = _get_model_version()
+    return classifier
+
 
+# Starts loading the model on the inference worker unless it is already loaded or loading (a failed load is retried),
+#   returns a future that resolves once it is loaded. Loading, and especially downloading the model on the first run,
+#   takes much longer than classifying, so it is started when the bot starts and is not counted against the timeout
+def load_classifier():
+    global classifier_load
+    if classifier_load is None or \
+            (classifier_load.done() and (classifier_load.cancelled() or classifier_load.exception() is not None)):
+        classifier_load = asyncio.get_event_loop().run_in_executor(inference_executor, _load_classifier)
+        classifier_load.add_done_callback(_print_classifier_load_failure)
+    return classifier_load
 
-tokenizer = AutoTokenizer.from_pretrained(SENTIMENT_ANALYSIS_MODEL_DIR)
-model = AutoModelForSequenceClassification.from_pretrained(SENTIMENT_ANALYSIS_MODEL_DIR)
-classifier = pipeline("sentiment-analysis", tokenizer=tokenizer, model=model)
 
+def _print_classifier_load_failure(load_future):
+    if not load_future.cancelled() and load_future.exception() is not None:
+        print("Failed to load sentiment analysis model: {}".format(load_future.exception()))
 
+
+# Classifies the strings in batches of SENTIMENT_ANALYSIS_BATCH_SIZE, padding the strings in each batch to the same
+#   length and truncating strings longer than the model accepts
+# This blocks while the model runs, so it should only be called on the inference worker
 def _classify_strings(strings):
-    return classifier(strings)
+    _load_classifier()
+    return classifier(
+        strings,
+        batch_size=user_preferences.SENTIMENT_ANALYSIS_BATCH_SIZE,
+        padding=True,
+        truncation=True,
+        max_length=user_preferences.SENTIMENT_ANALYSIS_MAX_LENGTH or tokenizer.model_max_length
+    )
+
+
+# Identifies the saved model by a hash of its configuration
+def _get_model_version():
+    config_path = os.path.join(SENTIMENT_ANALYSIS_MODEL_DIR, "config.json")
+    with open(config_path, "rb") as config_file:
+        return hashlib.sha1(config_file.read()).hexdigest()
+
+
+# Text is compared ignoring leading, trailing and repeated whitespace
+def _get_classification_cache_key(string, model_version):
+    normalized_string = " ".join(string.split())
+    content_hash = hashlib.sha256(normalized_string.encode("utf-8")).hexdigest()
+    # Truncation changes what the model sees, so results are only reused for the same maximum length
+    return "{}:{}:{}:{}".format(
+        SENTIMENT_ANALYSIS_MODEL_NAME, model_version, user_preferences.SENTIMENT_ANALYSIS_MAX_LENGTH, content_hash)
+
+
+def _get_classification_cache_connection():
+    global classification_cache_connection
+    if classification_cache_connection is None and user_preferences.SENTIMENT_ANALYSIS_CACHE_FILE:
+        classification_cache_connection = sqlite3.connect(user_preferences.SENTIMENT_ANALYSIS_CACHE_FILE)
+        classification_cache_connection.execute(
+            "CREATE TABLE IF NOT EXISTS classifications (key TEXT PRIMARY KEY, label TEXT NOT NULL, score REAL NOT NULL)")
+    return classification_cache_connection
+
+
+# Returns the saved results of the keys that are in the SQLite file, keyed by cache key
+def _load_persisted_classifications(cache_keys):
+    connection = _get_classification_cache_connection()
+    persisted_classifications = {}
+    if connection is None:
+        return persisted_classifications
+    # SQLite limits the number of parameters in a query
+    for batch_start in range(0, len(cache_keys), 500):
+        batch_keys = cache_keys[batch_start:batch_start + 500]
+        rows = connection.execute(
+            "SELECT key, label, score FROM classifications WHERE key IN ({})".format(", ".join("?" * len(batch_keys))),
+            batch_keys
+        )
+        for cache_key, label, score in rows:
+            persisted_classifications[cache_key] = {"label": label, "score": score}
+    return persisted_classifications
+
+
+def _persist_classifications(classifications):
+    connection = _get_classification_cache_connection()
+    if connection is not None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO classifications (key, label, score) VALUES (?, ?, ?)",
+            [(cache_key, res["label"], res["score"]) for cache_key, res in classifications.items()]
+        )
+        connection.commit()
+
+
+def _store_classifications(classifications):
+    for cache_key, classification in classifications.items():
+        classification_cache.set(cache_key, classification)
+    _persist_classifications(classifications)
+
+
+# Returns the classification of each string, only sending strings that have not been classified before to the
+#   inference worker. Strings that could not be classified in time have a classification of None
+async def _classify_strings_with_cache(strings):
+    global persisted_classification_hits
+    # Until the model has been loaded there is no version to key results by, so results are only cached once the
+    #   classification has loaded it
+    if model_version is None:
+        classification_cache.record_lookups(0, len(strings))
+        results = await _classify_strings_off_event_loop(strings)
+        if results is None:
+            return [None] * len(strings)
+        if model_version is not None:
+            _store_classifications(dict(zip(
+                [_get_classification_cache_key(string, model_version) for string in strings], results)))
+        return results
+
+    cache_keys = [_get_classification_cache_key(string, model_version) for string in strings]
+    classifications = {}
+    for cache_key in cache_keys:
+        cached_classification = classification_cache.get(cache_key)
+        if cached_classification is not None:
+            classifications[cache_key] = cached_classification
+    missing_keys = [cache_key for cache_key in dict.fromkeys(cache_keys) if cache_key not in classifications]
+    if len(missing_keys) > 0:
+        persisted_classifications = _load_persisted_classifications(missing_keys)
+        persisted_classification_hits += len(persisted_classifications)
+        for cache_key, persisted_classification in persisted_classifications.items():
+            classification_cache.set(cache_key, persisted_classification)
+        classifications.update(persisted_classifications)
+
+    # Each distinct string is classified once, so repeats within the batch also count as hits
+    strings_to_classify = {}
+    for cache_key, string in zip(cache_keys, strings):
+        if cache_key not in classifications:
+            strings_to_classify.setdefault(cache_key, string)
+    classification_cache.record_lookups(len(strings) - len(strings_to_classify), len(strings_to_classify))
+    if len(strings_to_classify) > 0:
+        results = await _classify_strings_off_event_loop(list(strings_to_classify.values()))
+        if results is not None:
+            new_classifications = dict(zip(strings_to_classify.keys(), results))
+            _store_classifications(new_classifications)
+            classifications.update(new_classifications)
+    return [classifications.get(cache_key) for cache_key in cache_keys]
+
+
+def _get_inference_queue():
+    global inference_queue
+    global inference_queue_worker
+    if inference_queue is None:
+        inference_queue = asyncio.Queue(maxsize=user_preferences.SENTIMENT_ANALYSIS_QUEUE_SIZE)
+    if inference_queue_worker is None or inference_queue_worker.done():
+        inference_queue_worker = asyncio.ensure_future(_process_inference_queue())
+    return inference_queue
+
+
+# Hands queued requests to the inference worker one at a time, skipping requests that have already timed out
+async def _process_inference_queue():
+    while True:
+        strings, result_future = await inference_queue.get()
+        try:
+            if not result_future.done():
+                results = await asyncio.get_event_loop().run_in_executor(inference_executor, _classify_strings, strings)
+                if not result_future.done():
+                    result_future.set_result(results)
+        except Exception as e:
+            inference_stats["failures"] += 1
+            if not result_future.done():
+                result_future.set_exception(e)
+        finally:
+            inference_queue.task_done()
+
+
+async def _queue_and_classify_strings(strings):
+    result_future = asyncio.get_event_loop().create_future()
+    # Waits here while the queue is full, so a backlog of batches does not grow without bound
+    await _get_inference_queue().put((strings, result_future))
+    return await result_future
+
+
+# Classifies the strings on the inference worker, returns None if they could not be classified within
+#   SENTIMENT_ANALYSIS_TIMEOUT seconds (including the time spent waiting in the queue, but not loading the model)
+async def _classify_strings_off_event_loop(strings):
+    try:
+        await asyncio.shield(load_classifier())
+    except Exception:
+        inference_stats["failures"] += 1
+        raise
+    start_time = time.perf_counter()
+    inference_stats["requests"] += 1
+    try:
+        return await asyncio.wait_for(
+            _queue_and_classify_strings(strings), timeout=user_preferences.SENTIMENT_ANALYSIS_TIMEOUT)
+    except asyncio.TimeoutError:
+        inference_stats["timeouts"] += 1
+        print("Sentiment analysis of {} posts timed out".format(len(strings)))
+        return None
+    finally:
+        latency = time.perf_counter() - start_time
+        inference_stats["total_latency"] += latency
+        inference_stats["max_latency"] = max(inference_stats["max_latency"], latency)
+
+
+def get_inference_stats():
+    return {
+        "queue_depth": inference_queue.qsize() if inference_queue is not None else 0,
+        "requests": inference_stats["requests"],
+        "timeouts": inference_stats["timeouts"],
+        "failures": inference_stats["failures"],
+        "average_latency": inference_stats["total_latency"] / max(inference_stats["requests"], 1),
+        "max_latency": inference_stats["max_latency"],
+        "cache": classification_cache.stats(),
+        "persisted_cache_hits": persisted_classification_hits,
+    }
 
 
 def _match_feedback_string(res):
@@ -33,10 +282,22 @@ def _match_feedback_string(res):
         score_str, user_preferences.SENTIMENT_ANALYSIS_NEGATIVE_THRESHOLD)
 
 
-def check_post_sentiment_violated(post):
-    content_string = post["content"]
-    res = _classify_strings(content_string)[0]
+def _get_sentiment_violation(res):
     if res["label"].lower() == "negative" and res["score"] >= user_preferences.SENTIMENT_ANALYSIS_NEGATIVE_THRESHOLD:
         return _match_feedback_string(res)
     else:
         return None
+
+
+async def check_post_sentiment_violated(post):
+    return (await check_posts_sentiment_violated([post]))[0]
+
+
+# Classifies the content of all of the posts together, returns the feedback string of each post whose content is
+#   negative enough to violate the threshold (or None), in the same order as the posts
+# Posts that could not be classified in time are treated as not violating the threshold
+async def check_posts_sentiment_violated(posts):
+    if len(posts) == 0:
+        return []
+    results = await _classify_strings_with_cache([post["content"] for post in posts])
+    return [_get_sentiment_violation(res) if res is not None else None for res in results]
@@ -3,8 +3,28 @@ import user_preferences
 from advanced_filter_files import semantic_analysis
 
 
-def apply_advanced_filter(filter_type, post):
+# Starts loading the models of the enabled advanced filters in the background, so they are ready before the first posts
+def load_advanced_filters():
+    if user_preferences.SENTIMENT_ANALYSIS_ENABLED:
+        semantic_analysis.load_classifier()
+
+
+async def apply_advanced_filter(filter_type, post):
+    return (await apply_advanced_filter_to_posts(filter_type, [post]))[0]
+
+
+# Applies an advanced filter to a batch of posts, returns the result for each post in the same order
+async def apply_advanced_filter_to_posts(filter_type, posts):
     if user_preferences.SENTIMENT_ANALYSIS_ENABLED and filter_type == constants.RedditFilterTypes.ADVANCED_SENTIMENT_ANALYSIS.value:
-        return semantic_analysis.check_post_sentiment_violated(post)
+        return await semantic_analysis.check_posts_sentiment_violated(posts)
     else:
-        return None
+        return [None] * len(posts)
+
+
+# Returns the stats of each enabled advanced filter, keyed by filter type
+def get_advanced_filter_stats():
+    advanced_filter_stats = {}
+    if user_preferences.SENTIMENT_ANALYSIS_ENABLED:
+        advanced_filter_stats[constants.RedditFilterTypes.ADVANCED_SENTIMENT_ANALYSIS.value] = \
+            semantic_analysis.get_inference_stats()
+    return advanced_filter_stats
@@ -0,0 +1,83 @@
+# This script benchmarks the posts filters against posts already stored in the database
+
+# It compares searching each regex phrase one by one (how posts filters were originally checked) with the compiled
+#   matchers used by filters.py, and verifies that both find the same matches
+# Usage: python benchmark_filters.py [number of submissions and comments to load, defaults to 5000]
+
+import re
+import sys
+import time
+import pymongo
+import classes
+import constants
+import environment_variables
+import keyword_automaton
+
+corpus_size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+client = pymongo.MongoClient(environment_variables.DATABASE_URI)
+db = client["reddit"]
+
+# Corpus of every title and body to check, newest posts first
+corpus = []
+newest_first = [("created_time.utc", pymongo.DESCENDING)]
+for submission in db.submissions.find({"title": {"$exists": True}}).sort(newest_first).limit(corpus_size):
+    corpus.append(submission["title"])
+    corpus.append(submission.get("content") or "")
+for comment in db.comments.find({"content": {"$exists": True}}).sort(newest_first).limit(corpus_size):
+    corpus.append(comment["content"] or "")
+
+posts_filters = list(db.filters.find({"type": constants.RedditFilterTypes.POSTS.value}))
+num_phrases = sum(len(posts_filter["matches"]) for posts_filter in posts_filters)
+num_literals = sum(1 for posts_filter in posts_filters for phrase in posts_filter["matches"]
+                   if keyword_automaton.get_literal_of_regex_phrase(phrase) is not None)
+print("Corpus: {} texts, {} posts filters with {} phrases ({} literal)".format(
+    len(corpus), len(posts_filters), num_phrases, num_literals))
+print("Keyword automaton: {}".format("pyahocorasick" if keyword_automaton.ahocorasick is not None else "pure Python"))
+
+
+# Searches each phrase of each filter one by one
+def find_matches_by_phrase(valid_phrases_of_filters):
+    found_matches = []
+    for text in corpus:
+        for valid_phrases in valid_phrases_of_filters:
+            found_matches.append([index for index, phrase in valid_phrases if re.search(phrase, text)])
+    return found_matches
+
+
+def find_matches_by_compiled_matcher(matchers):
+    found_matches = []
+    for text in corpus:
+        for matcher in matchers:
+            found_matches.append(matcher.find_matching_indexes(text))
+    return found_matches
+
+
+# Invalid phrases are left out of both, since the compiled matchers skip them
+valid_phrases_of_filters = []
+for posts_filter in posts_filters:
+    valid_phrases = []
+    for index, phrase in enumerate(posts_filter["matches"]):
+        try:
+            re.compile(phrase)
+            valid_phrases.append((index, phrase))
+        except (re.error, TypeError):
+            pass
+    valid_phrases_of_filters.append(valid_phrases)
+
+start_time = time.perf_counter()
+phrase_matches = find_matches_by_phrase(valid_phrases_of_filters)
+phrase_seconds = time.perf_counter() - start_time
+
+start_time = time.perf_counter()
+compiled_matchers = [classes.RegexPhraseMatcher(posts_filter["matches"]) for posts_filter in posts_filters]
+compile_seconds = time.perf_counter() - start_time
+start_time = time.perf_counter()
+compiled_matches = find_matches_by_compiled_matcher(compiled_matchers)
+compiled_seconds = time.perf_counter() - start_time
+
+print("Phrase by phrase: {:.3f}s".format(phrase_seconds))
+print("Compiled matchers: {:.3f}s (+{:.3f}s to compile)".format(compiled_seconds, compile_seconds))
+if compiled_seconds > 0:
+    print("Speedup: {:.1f}x".format(phrase_seconds / compiled_seconds))
+print("Matches identical: {}".format(phrase_matches == compiled_matches))
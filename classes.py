@@ -1,8 +1,18 @@
+import re
+import time
+import heapq
+import asyncio
+import itertools
+import collections
+import keyword_automaton
+
+
 # Class constructor for a subreddit and its associated channels to send messages to
 class SubredditAndChannels:
     def __init__(self, subreddit, main_channel_ids=None, post_channel_ids=None, comment_channel_ids=None,
                  ping_channel_ids=None, secondary_review_channel_ids=None, status_channel_ids=None,
-                 report_channel_ids=None, embed_colour=0xc77d00, has_mod=False):
+                 report_channel_ids=None, embed_colour=0xc77d00, has_mod=False, poll_timer=None,
+                 use_streaming=False):
         if status_channel_ids is None:
             status_channel_ids = []
         if secondary_review_channel_ids is None:
@@ -27,3 +37,361 @@ class SubredditAndChannels:
         self.status_channel_ids = status_channel_ids
         self.embed_colour = embed_colour
         self.has_mod = has_mod
+        self.poll_timer = poll_timer
+        self.use_streaming = use_streaming
+
+
+# Size-bounded LRU cache whose entries expire after ttl_seconds (entries never expire if ttl_seconds is None)
+# Concurrent get_or_load calls for the same key share a single load
+class TTLCache:
+    def __init__(self, max_size, ttl_seconds=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._pending_loads = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._get_entry(key) is not None
+
+    # Returns the entry for key if it exists and has not expired, evicting it if it has
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires_at"] is not None and entry["expires_at"] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    # Returns the cached value for key, or default if it is missing or expired (does not affect hit/miss counters)
+    def get(self, key, default=None):
+        entry = self._get_entry(key)
+        return entry["value"] if entry is not None else default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self._entries[key] = {"value": value, "expires_at": expires_at}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    # Counts lookups made with get by callers that load missing values themselves (e.g. in batches)
+    def record_lookups(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+
+    # Returns the cached value for key, otherwise awaits loader() and caches its result
+    # Exceptions raised by loader are passed to every caller waiting on that key and nothing is cached
+    async def get_or_load(self, key, loader):
+        entry = self._get_entry(key)
+        if entry is not None:
+            self.hits += 1
+            return entry["value"]
+
+        pending_load = self._pending_loads.get(key)
+        if pending_load is None:
+            self.misses += 1
+            pending_load = asyncio.ensure_future(self._load(key, loader))
+            self._pending_loads[key] = pending_load
+        else:
+            # Merged into a load that is already in progress, so no extra request is made
+            self.hits += 1
+        return await asyncio.shield(pending_load)
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            self._pending_loads.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "pending": len(self._pending_loads),
+        }
+
+
+# Chooses the number of minutes between polls of a subreddit from its recent activity. The interval is shortened when
+#   a poll returns a full chunk of posts (more are likely waiting) and lengthened when a poll returns nothing, always
+#   staying within min_minutes and max_minutes
+class AdaptivePollInterval:
+    def __init__(self, initial_minutes, min_minutes, max_minutes, speedup_factor=2.0, slowdown_factor=1.5):
+        self.min_minutes = min_minutes
+        self.max_minutes = max_minutes
+        self.speedup_factor = speedup_factor
+        self.slowdown_factor = slowdown_factor
+        self.interval_minutes = self._clamp(initial_minutes)
+        # Exponential moving average of new items per minute, None until the first poll is recorded
+        self.new_items_per_minute = None
+        self._last_poll_time = None
+
+    def _clamp(self, minutes):
+        return max(self.min_minutes, min(self.max_minutes, minutes))
+
+    # Records the result of a poll and returns the number of minutes to wait before the next one
+    def record_poll(self, num_new_items, is_chunk_full):
+        current_time = time.monotonic()
+        if self._last_poll_time is not None:
+            elapsed_minutes = max((current_time - self._last_poll_time) / 60, 1 / 60)
+        else:
+            elapsed_minutes = self.interval_minutes
+        self._last_poll_time = current_time
+
+        rate = num_new_items / elapsed_minutes
+        if self.new_items_per_minute is None:
+            self.new_items_per_minute = rate
+        else:
+            self.new_items_per_minute = (self.new_items_per_minute + rate) / 2
+
+        if is_chunk_full:
+            self.interval_minutes = self._clamp(self.interval_minutes / self.speedup_factor)
+        elif num_new_items == 0:
+            self.interval_minutes = self._clamp(self.interval_minutes * self.slowdown_factor)
+        return self.interval_minutes
+
+
+# Token bucket shared by every Reddit request. Requests wait for a token, and while the bucket is empty waiting requests
+#   are let through in priority order (lower values first, then first come first served)
+class RateBudgetScheduler:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.max_refill_per_second = refill_per_second
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        # Requests remaining in the current window according to Reddit's rate limit headers, None until known
+        self.remaining_requests = None
+        self._last_refill_time = time.monotonic()
+        self._waiters = []
+        self._waiter_sequence = itertools.count()
+        self._dispatcher = None
+
+    def _refill(self):
+        current_time = time.monotonic()
+        elapsed_seconds = current_time - self._last_refill_time
+        self.tokens = min(self.capacity, self.tokens + elapsed_seconds * self.refill_per_second)
+        self._last_refill_time = current_time
+
+    def queue_depth(self):
+        return len([waiter for waiter in self._waiters if not waiter[2].done()])
+
+    # Waits until a request of the given priority may be made
+    async def acquire(self, priority):
+        self._refill()
+        if len(self._waiters) == 0 and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._waiter_sequence), waiter))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await waiter
+
+    # Hands out tokens to waiting requests as they refill, highest priority first
+    async def _dispatch(self):
+        while len(self._waiters) > 0:
+            self._refill()
+            while len(self._waiters) > 0 and self.tokens >= 1:
+                waiter = heapq.heappop(self._waiters)[2]
+                # Cancelled requests do not use up the budget
+                if not waiter.done():
+                    waiter.set_result(None)
+                    self.tokens -= 1
+            if len(self._waiters) > 0:
+                await asyncio.sleep((1 - self.tokens) / self.refill_per_second)
+
+    # Adjusts the budget to what Reddit reports is left, spreading the remaining requests over the rest of the window
+    def update_from_headers(self, remaining_requests, seconds_until_reset):
+        self.remaining_requests = remaining_requests
+        self._refill()
+        self.tokens = min(self.tokens, remaining_requests)
+        self.refill_per_second = min(
+            self.max_refill_per_second, max(remaining_requests, 1) / max(seconds_until_reset, 1)
+        )
+
+    def stats(self):
+        self._refill()
+        return {
+            "tokens": self.tokens,
+            "remaining_requests": self.remaining_requests,
+            "queue_depth": self.queue_depth(),
+            "refill_per_second": self.refill_per_second,
+        }
+
+
+# Runs actions in the background on a fixed number of workers, one action at a time for each key in the order they were
+#   queued. An action that is already queued (or running, if nothing is queued after it) for the same key is not queued
+#   again, and callers share its result instead. Actions in the same group (e.g. remove and approve) undo each other, so a
+#   queued action is replaced by a later action of its group on the same key rather than running before it
+class CoalescingActionQueue:
+    def __init__(self, num_workers, run_action, action_groups=None):
+        self.num_workers = num_workers
+        # Coroutine function called with the action followed by the arguments it was queued with
+        self.run_action = run_action
+        # Group of each action, actions that are not listed are in a group of their own
+        self.action_groups = action_groups if action_groups is not None else {}
+        # Keys that have queued actions and no running action, in the order they became ready
+        self._ready_keys = None
+        self._workers = []
+        # Queued actions of each key as {group: {"action", "args", "future", "enqueued_time"}}, in the order queued
+        self._queued = {}
+        # Action currently running for each key as {"action", "future"}
+        self._running = {}
+        self.coalesced = 0
+        self.replaced = 0
+        self._action_stats = {}
+
+    # Queues the action unless it is already pending for the key, returning a future that resolves once it has run
+    # If a different action of the same group is queued for the key, it is replaced and its callers share this action's
+    #   result instead
+    def enqueue(self, key, action, *args):
+        group = self.action_groups.get(action, action)
+        queued_actions = self._queued.setdefault(key, collections.OrderedDict())
+        queued_action = queued_actions.get(group)
+        if queued_action is not None:
+            if queued_action["action"] == action:
+                self.coalesced += 1
+            else:
+                self.replaced += 1
+                queued_action["action"] = action
+            queued_action["args"] = args
+            return queued_action["future"]
+        running_action = self._running.get(key)
+        if running_action is not None and running_action["action"] == action:
+            self.coalesced += 1
+            return running_action["future"]
+
+        self._start_workers()
+        future = asyncio.get_event_loop().create_future()
+        # Failures are recorded in the stats, so callers that do not wait for the result do not need to retrieve them
+        future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        queued_actions[group] = {"action": action, "args": args, "future": future, "enqueued_time": time.monotonic()}
+        if len(queued_actions) == 1 and key not in self._running:
+            self._ready_keys.put_nowait(key)
+        return future
+
+    def _start_workers(self):
+        if self._ready_keys is None:
+            self._ready_keys = asyncio.Queue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.num_workers:
+            self._workers.append(asyncio.ensure_future(self._work()))
+
+    async def _work(self):
+        while True:
+            key = await self._ready_keys.get()
+            queued_action = self._queued[key].popitem(last=False)[1]
+            action = queued_action["action"]
+            future = queued_action["future"]
+            self._running[key] = {"action": action, "future": future}
+            try:
+                await self.run_action(action, *queued_action["args"])
+            except Exception as e:
+                self._record(action, queued_action["enqueued_time"], False)
+                print("Action {} on {} failed: {}".format(action, key, e))
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self._record(action, queued_action["enqueued_time"], True)
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                del self._running[key]
+                # The key's next action can only start once this one has finished
+                if len(self._queued[key]) > 0:
+                    self._ready_keys.put_nowait(key)
+                else:
+                    del self._queued[key]
+                self._ready_keys.task_done()
+
+    # Records the outcome of an action and its latency from being queued to finishing
+    def _record(self, action, enqueued_time, succeeded):
+        latency = time.monotonic() - enqueued_time
+        action_stats = self._action_stats.setdefault(
+            action, {"succeeded": 0, "failed": 0, "total_latency": 0.0, "max_latency": 0.0})
+        action_stats["succeeded" if succeeded else "failed"] += 1
+        action_stats["total_latency"] += latency
+        action_stats["max_latency"] = max(action_stats["max_latency"], latency)
+
+    def stats(self):
+        actions = {}
+        for action, action_stats in self._action_stats.items():
+            num_runs = action_stats["succeeded"] + action_stats["failed"]
+            actions[action] = {
+                "succeeded": action_stats["succeeded"],
+                "failed": action_stats["failed"],
+                "average_latency": action_stats["total_latency"] / num_runs,
+                "max_latency": action_stats["max_latency"],
+            }
+        queue_depth = sum(len(queued_actions) for queued_actions in self._queued.values())
+        return {
+            "queue_depth": queue_depth,
+            "pending": queue_depth + len(self._running),
+            "coalesced": self.coalesced,
+            "replaced": self.replaced,
+            "actions": actions,
+        }
+
+
+# Matches text against a list of regex phrases. Phrases that only match their own text (plain words, escaped URLs) are
+#   found together with a single scan of the text by a keyword_automaton.KeywordAutomaton. The other phrases are
+#   compiled once, and those that can safely be combined are also joined into a single alternation that is searched
+#   first, since most text matches none of them and is then rejected in one pass rather than one search per phrase
+class RegexPhraseMatcher:
+    # Phrases with backreferences, named groups or global inline flags behave differently inside a combined pattern
+    _UNCOMBINABLE_PHRASE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)")
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        literals_and_indexes = []
+        # (index, compiled phrase) of every other valid phrase, and of the phrases that must always be searched
+        #   individually
+        self._compiled_phrases = []
+        self._uncombined_phrases = []
+        combinable_phrases = []
+        for index, phrase in enumerate(self.phrases):
+            literal = keyword_automaton.get_literal_of_regex_phrase(phrase) if isinstance(phrase, str) else None
+            if literal is not None:
+                literals_and_indexes.append((literal, index))
+                continue
+            try:
+                compiled_phrase = re.compile(phrase)
+            except (re.error, TypeError) as e:
+                print("Skipping invalid regex phrase {}: {}".format(phrase, e))
+                continue
+            self._compiled_phrases.append((index, compiled_phrase))
+            if self._UNCOMBINABLE_PHRASE.search(phrase):
+                self._uncombined_phrases.append((index, compiled_phrase))
+            else:
+                combinable_phrases.append(phrase)
+        self._literal_phrases = keyword_automaton.KeywordAutomaton(literals_and_indexes)
+        self._combined_phrases = None
+        if combinable_phrases:
+            try:
+                self._combined_phrases = re.compile("|".join("(?:{})".format(phrase) for phrase in combinable_phrases))
+            except re.error:
+                self._uncombined_phrases = self._compiled_phrases
+
+    # Returns the indexes of the phrases found in the text, in the order the phrases were given
+    def find_matching_indexes(self, text):
+        if self._combined_phrases is not None and self._combined_phrases.search(text):
+            candidate_phrases = self._compiled_phrases
+        else:
+            candidate_phrases = self._uncombined_phrases
+        matching_indexes = self._literal_phrases.find_values(text)
+        matching_indexes.update(index for index, compiled_phrase in candidate_phrases if compiled_phrase.search(text))
+        return sorted(matching_indexes)
@@ -16,6 +16,12 @@ class PostTypes(Enum):
     REDDIT_COMMENT = "reddit_comment"
 
 
+# Prefixes Reddit adds to post IDs to form fullnames
+class RedditFullnamePrefixes(Enum):
+    REDDIT_SUBMISSION = "t3_"
+    REDDIT_COMMENT = "t1_"
+
+
 # Enumeration to store filter actions
 class FilterActions(Enum):
     REMOVE = "remove"
@@ -39,6 +45,10 @@ class RedditUserUpsertStatus(Enum):
     MISSING = "missing"
 
 
+class RedditAutomodConsts(Enum):
+    WIKI_PAGE_NAME = "config/automoderator"
+
+
 class RedditAutomodEditStatus(Enum):
     SUCCESS = "success"
     FAIL = "fail"
@@ -165,7 +175,10 @@ class StringConstants(Enum):
     SECONDARY_REVIEW_TITLE_PREFIX = "Secondary review requested"
     SECONDARY_REVIEW_REQUESTED_BY_SEPARATOR = "by"
     REPOST_CURRENT_POST_TITLE = "Potential Repost"
+    DELETED_AUTHOR = "[DELETED]"
     REPOST_PREVIOUS_POST_TITLE = "Previous Post"
+    NEGATIVE_COMMENT_TREE_SCANNED = "Scanned {} of {} comments."
+    NEGATIVE_COMMENT_TREE_UNEXPANDED = " {} comment threads were not loaded, react again to scan deeper."
 
 
 class RedditDiscordChannelTypes(Enum):
@@ -179,15 +192,34 @@ class RedditDiscordChannelTypes(Enum):
 
 class BotHealthMessages(Enum):
     POLLING_START = "Polling loop task has started."
-    POLLING_UP = "Bot querying for posts..."
     TASK_FAILED_AND_RESTART = "An internal loop task has failed. Attempting to restart..."
+    POLL_COMPLETE = "r/{} polled in {:.2f}s ({} new posts)"
+    POLL_FAILED = "Polling r/{} failed: {}"
 
 
 class DatabaseMetadataInfo(Enum):
     IGNORE_BUFFER_NAME = "Ignore Buffer"  # Name field for the ignore buffer in the database metadata
-    REPORT_TIMESTAMPS_NAME = "Latest Report Timestamps"  # Name field for report timestamps metadata
-    REPORT_TIMESTAMPS_DESCRIPTION = "Stores timestamps of latest reports received per subreddit to determine whether " \
-                                    "report stream contains new reports "
+    REPORT_FINGERPRINTS_NAME = "Report Fingerprints"  # Name field for report fingerprints metadata
+    REPORT_FINGERPRINTS_DESCRIPTION = "Stores a fingerprint of the reports on each item in the mod queue per subreddit " \
+                                      "to determine which items have new reports"
+    POST_MARKS_NAME = "Latest Post Marks"  # Name field for the newest processed post of each subreddit and post type
+    POST_MARKS_DESCRIPTION = "Stores the fullname and creation time of the newest post processed per subreddit and " \
+                             "post type, used to determine where to stop querying for new posts"
+
+
+# Priority classes of the shared Reddit rate budget, requests with lower values are let through first
+class RedditRequestPriority(Enum):
+    INTERACTIVE = 0  # Actions and lookups triggered by moderators
+    INGESTION = 1  # Polling for new posts, comments and reports
+    BACKGROUND = 2  # Scans that can wait, e.g. user history checks
+
+
+class RedditApiLimits(Enum):
+    INFO_FULLNAMES_PER_REQUEST = 100
+
+
+class DatabaseErrorCodes(Enum):
+    DUPLICATE_KEY = 11000
 
 
 ActionPriorityDictionary = {
@@ -201,6 +233,18 @@ ActionPriorityDictionary = {
 }
 
 
+# Estimated relative cost of applying each type of filter to a post, filters are applied cheapest first
+# Filter types missing from here (i.e. other advanced filters) are assumed to be as expensive as sentiment analysis
+FilterTypeCosts = {
+    RedditFilterTypes.USERS.value: 1,
+    RedditFilterTypes.SUBREDDITS.value: 1,
+    RedditFilterTypes.MEDIA_SOURCE.value: 1,
+    RedditFilterTypes.POSTS.value: 10,
+    RedditFilterTypes.MEDIA_SOURCE_HISTORY.value: 20,  # Queries the database
+    RedditFilterTypes.ADVANCED_SENTIMENT_ANALYSIS.value: 1000,  # Runs model inference
+}
+
+
 # Currently only works with 1 word strings (e.g. links) with whitespace checks
 def create_regex_string(regex_matchers):
     return ".*((" + ")|(".join(regex_matchers) + ")).*"
@@ -1,13 +1,21 @@
+import asyncio
+import hashlib
+import datetime
+import pymongo
 from pymongo import MongoClient
 import wrangler
 import praw_operations
 import constants
 import environment_variables
+import user_preferences
 
 # Database setup
 client = MongoClient(environment_variables.DATABASE_URI)
 db = client.reddit
 
+# Whether the indexes of the media history collection have been checked since startup
+media_history_indexes_created = False
+
 
 # Attempts to add or remove match on filter, returns the newly updated matches if successful
 # If the filter is of user type, will also update tags
@@ -101,6 +109,7 @@ async def add_or_update_user(username):
         return constants.RedditUserUpsertStatus.SUSPENDED.value
 
 
+# Note: If changing schema here, also change in _log_user_reported_content()
 def _add_new_user_to_db(username, userdata):
     db.users.insert_one({
         "_id": userdata.id,
@@ -113,9 +122,9 @@ def _add_new_user_to_db(username, userdata):
 
 # If user already in database, only updates, if not already in database, instantiates empty lists for mod comments
 #   and tags then updates information.
-async def _add_or_update_user_db(username):
-    userdata = await praw_operations.get_redditor(username)
-    await userdata.load()
+# User lookups default to interactive priority since they are requested by moderators through commands and reacts
+async def _add_or_update_user_db(username, priority=constants.RedditRequestPriority.INTERACTIVE):
+    userdata = await praw_operations.get_loaded_redditor(username, priority)
 
     if hasattr(userdata, 'is_suspended') and userdata.is_suspended:
         return constants.RedditUserUpsertStatus.MISSING.value
@@ -234,16 +243,122 @@ def get_ignore_buffer():
     return db.metadata.find_one({"name": constants.DatabaseMetadataInfo.IGNORE_BUFFER_NAME.value})
 
 
-def clear_ignore_buffer():
-    db.metadata.find_one_and_update(
-        {"name": constants.DatabaseMetadataInfo.IGNORE_BUFFER_NAME.value},
-        {"$set": {"items": []}}
+# Removes the given post IDs from the ignore buffer if they are posts of the subreddit, IDs of other polled subreddits'
+#   posts are left for those subreddits' polls. IDs of posts that are not stored or that belong to a subreddit that is not
+#   polled would never be removed by a poll, so they are removed as well
+def remove_subreddit_posts_from_ignore_buffer(subreddit_name, post_ids, polled_subreddit_names):
+    if len(post_ids) == 0:
+        return
+    other_polled_subreddits = {name.lower() for name in polled_subreddit_names} - {subreddit_name.lower()}
+    other_polled_post_ids = set()
+    for collection in [db.submissions, db.comments]:
+        for post in collection.find({"_id": {"$in": post_ids}}, {"_id": 1, "subreddit": 1}):
+            if post["subreddit"].lower() in other_polled_subreddits:
+                other_polled_post_ids.add(post["_id"])
+    removed_post_ids = [post_id for post_id in post_ids if post_id not in other_polled_post_ids]
+    if len(removed_post_ids) > 0:
+        db.metadata.update_one(
+            {"name": constants.DatabaseMetadataInfo.IGNORE_BUFFER_NAME.value},
+            {"$pullAll": {"items": removed_post_ids}}
+        )
+
+
+# Returns the newest processed post for a subreddit and post type as {"id": fullname, "created_utc": utc}, if any
+def get_post_high_water_mark(subreddit_name, post_type):
+    post_marks = db.metadata.find_one({"name": constants.DatabaseMetadataInfo.POST_MARKS_NAME.value})
+    if post_marks is None:
+        return None
+    return post_marks["subreddit_marks"].get(subreddit_name, {}).get(post_type.value)
+
+
+# Moves the high water mark forward to the newest of the newly processed posts, creates post marks metadata if nonexistent
+def update_post_high_water_mark(subreddit_name, post_type, new_posts):
+    if len(new_posts) == 0:
+        return
+    newest_post = max(new_posts, key=lambda post: post["created_time"]["utc"])
+    stored_mark = get_post_high_water_mark(subreddit_name, post_type)
+    if stored_mark is not None and stored_mark["created_utc"] > newest_post["created_time"]["utc"]:
+        return
+    db.metadata.update_one(
+        {"name": constants.DatabaseMetadataInfo.POST_MARKS_NAME.value},
+        {
+            "$set": {"subreddit_marks.{}.{}".format(subreddit_name, post_type.value): {
+                "id": praw_operations.get_entry_object_fullname(newest_post),
+                "created_utc": newest_post["created_time"]["utc"],
+            }},
+            "$setOnInsert": {"description": constants.DatabaseMetadataInfo.POST_MARKS_DESCRIPTION.value},
+        },
+        upsert=True
     )
 
 
-def update_media_source_history_matches(filter_name, updated_matches):
-    filter_name_object = {"name": filter_name}
-    db.filters.find_one_and_update(filter_name_object, {"$set": {"matches": updated_matches}})
+# Media titles are compared ignoring case and repeated whitespace
+def normalize_media_title(media_title):
+    return " ".join(media_title.split()).casefold()
+
+
+# Creates the media history indexes if they do not exist yet, titles are looked up by filter name and normalized title
+#   and entries with an expire_at date are removed by MongoDB once it has passed
+def _ensure_media_history_indexes():
+    global media_history_indexes_created
+    if not media_history_indexes_created:
+        db.media_history.create_index(
+            [("filter_name", pymongo.ASCENDING), ("normalized_title", pymongo.ASCENDING)], unique=True)
+        db.media_history.create_index("expire_at", expireAfterSeconds=0)
+        media_history_indexes_created = True
+
+
+# Returns the stored media history entry of the title for a media source history filter as {"match", "date_added"}
+def get_media_history_match(filter_name, media_title):
+    _ensure_media_history_indexes()
+    media_history = db.media_history.find_one(
+        {"filter_name": filter_name, "normalized_title": normalize_media_title(media_title)})
+    if media_history is None:
+        return None
+    return {"match": media_history["title"], "date_added": media_history["date_added"]}
+
+
+# Records the date a title was posted for a media source history filter, replacing any previous date
+# If MEDIA_HISTORY_EXPIRY is set, the title is forgotten that many minutes after the filter's cooldown has passed
+def upsert_media_history(filter_name, media_title, post_created_utc, cooldown):
+    _ensure_media_history_indexes()
+    updated_fields = {
+        "title": media_title,
+        "date_added": datetime.datetime.fromtimestamp(post_created_utc),
+    }
+    media_history_expiry = user_preferences.BotConsts.MEDIA_HISTORY_EXPIRY.value
+    if media_history_expiry is not None:
+        # TTL indexes compare against UTC, unlike date_added which is stored in local time like the rest of the filter
+        updated_fields["expire_at"] = datetime.datetime.utcfromtimestamp(post_created_utc) + \
+            datetime.timedelta(minutes=cooldown + media_history_expiry)
+    db.media_history.update_one(
+        {"filter_name": filter_name, "normalized_title": normalize_media_title(media_title)},
+        {"$set": updated_fields},
+        upsert=True
+    )
+
+
+# Moves media history still stored as {"match", "date_added"} objects in a filter's matches array to the media history
+#   collection, keeping the most recent date of each title. Moved matches are pulled from the filter, matches of media
+#   without a title are dropped since untitled media is not kept in the history
+def migrate_media_history_matches(media_history_filter):
+    _ensure_media_history_indexes()
+    legacy_matches = [match for match in media_history_filter["matches"] if isinstance(match, dict)]
+    if len(legacy_matches) == 0:
+        return
+    titled_legacy_matches = [match for match in legacy_matches if match["match"] is not None]
+    if len(titled_legacy_matches) > 0:
+        db.media_history.bulk_write([
+            pymongo.UpdateOne(
+                {"filter_name": media_history_filter["name"], "normalized_title": normalize_media_title(match["match"])},
+                {"$max": {"date_added": match["date_added"]}, "$setOnInsert": {"title": match["match"]}},
+                upsert=True
+            ) for match in titled_legacy_matches
+        ], ordered=False)
+    db.filters.update_one({"name": media_history_filter["name"]}, {"$pullAll": {"matches": legacy_matches}})
+    media_history_filter["matches"] = [match for match in media_history_filter["matches"] if not isinstance(match, dict)]
+    print("Moved {} media history matches of {} to the media history collection".format(
+        len(legacy_matches), media_history_filter["name"]))
 
 
 # Checks if post is repost
@@ -263,103 +378,106 @@ def get_reposts_of_post(post_id):
     return []
 
 
+# Logs reports that are new or have changed since the last poll of the subreddit's mod queue, returns the new reports
 async def db_operations_on_reported_content(subreddit_name, reported_content):
-    latest_comment_timestamp = reported_content["comments"][0]["created_utc"] if len(reported_content["comments"]) > 0 else 0
-    latest_submission_timestamp = reported_content["submissions"][0]["created_utc"] if len(reported_content["submissions"]) > 0 else 0
-    latest_current_timestamp = max(latest_comment_timestamp, latest_submission_timestamp)
-    latest_stored_timestamp = _get_latest_stored_report_timestamp(subreddit_name) or 0
     combined_reported_content = reported_content["comments"] + reported_content["submissions"]
-
-    new_reports = []
-    # If we have new reports, log them, and update the latest timestamp
-    if latest_stored_timestamp == 0 or latest_stored_timestamp < latest_current_timestamp:
-        for report in combined_reported_content:
-            # Only log new reports
-            if latest_stored_timestamp < report["created_utc"]:
-                await _log_reported_content(report)
-                new_reports.append(_construct_report(report))
-        _update_latest_report_timestamp(subreddit_name, latest_current_timestamp)
-    return new_reports
-
-
-# Checks metadata for latest report timestamp, creates report metadata if nonexistent
-def _get_latest_stored_report_timestamp(subreddit_name):
-    query = {"name": constants.DatabaseMetadataInfo.REPORT_TIMESTAMPS_NAME.value}
-    # Create metadata object if it doesn't exist
-    if db.metadata.find_one(query) is None:
-        _create_reports_metadata()
-
-    latest_subreddit_reports = db.metadata.find_one(query)["latest_subreddit_reports"]
-    stored_latest_timestamp = None
-    if subreddit_name in latest_subreddit_reports:
-        # If we have a timestamp for a previous report on this subreddit, fetch the timestamp
-        stored_latest_timestamp = latest_subreddit_reports[subreddit_name]
-
-    return stored_latest_timestamp
-
-
-# Creates the default report metadata entry
-def _create_reports_metadata():
-    db.metadata.insert_one({
-        "name": constants.DatabaseMetadataInfo.REPORT_TIMESTAMPS_NAME.value,
-        "description": constants.DatabaseMetadataInfo.REPORT_TIMESTAMPS_DESCRIPTION.value,
-        "latest_subreddit_reports": {},
-    })
-
-
-# Update the store timestamp to a newer timestamp
-def _update_latest_report_timestamp(subreddit_name, curr_latest_timestamp):
-    reports_metadata_query = {"name": constants.DatabaseMetadataInfo.REPORT_TIMESTAMPS_NAME.value}
-    report_timestamps = db.metadata.find_one(reports_metadata_query)
-    updated_timestamps = report_timestamps["latest_subreddit_reports"]
-    updated_timestamps[subreddit_name] = curr_latest_timestamp
-    db.metadata.find_one_and_update(
-        reports_metadata_query, {"$set": {"latest_subreddit_reports": updated_timestamps}})
+    stored_fingerprints = _get_report_fingerprints(subreddit_name)
+    current_fingerprints = {}
+    new_reported_content = []
+    for content in combined_reported_content:
+        fingerprint = _get_report_fingerprint(content)
+        current_fingerprints[content["name"]] = fingerprint
+        # Items that have left the mod queue are forgotten, so they count as new if they are reported again
+        if stored_fingerprints.get(content["name"]) != fingerprint:
+            new_reported_content.append(content)
+
+    # Reports are logged per author, so each author is loaded from Reddit and written to the database once
+    reported_content_by_author = {}
+    for content in new_reported_content:
+        if content["author"] is not None:
+            reported_content_by_author.setdefault(content["author"].name, []).append(content)
+    await asyncio.gather(*[_log_user_reported_content(username, user_reported_content)
+                           for username, user_reported_content in reported_content_by_author.items()])
+
+    if current_fingerprints != stored_fingerprints:
+        _update_report_fingerprints(subreddit_name, current_fingerprints)
+    return [_construct_report(content) for content in new_reported_content]
+
+
+# Returns the fingerprint of each reported item's reports when the subreddit's mod queue was last polled, keyed by
+#   fullname
+def _get_report_fingerprints(subreddit_name):
+    report_fingerprints = db.metadata.find_one({"name": constants.DatabaseMetadataInfo.REPORT_FINGERPRINTS_NAME.value})
+    if report_fingerprints is None:
+        return {}
+    return report_fingerprints["subreddit_fingerprints"].get(subreddit_name, {})
+
+
+# Replaces the stored report fingerprints of the subreddit, creates report fingerprints metadata if nonexistent
+def _update_report_fingerprints(subreddit_name, current_fingerprints):
+    db.metadata.update_one(
+        {"name": constants.DatabaseMetadataInfo.REPORT_FINGERPRINTS_NAME.value},
+        {
+            "$set": {"subreddit_fingerprints.{}".format(subreddit_name): current_fingerprints},
+            "$setOnInsert": {"description": constants.DatabaseMetadataInfo.REPORT_FINGERPRINTS_DESCRIPTION.value},
+        },
+        upsert=True
+    )
 
 
-async def _log_reported_content(content):
-    # Ensure user exists in database before attempting to add report
-    #   we do not add suspended users due to missing required userdata
-    user_status = await _add_or_update_user_db(content["author"].name)
+# Fingerprints the reports on an item so that it changes whenever the item is reported again
+# User reports are [reason, count, ...] and moderator reports are [reason, moderator name], so a report with a reason
+#   that has already been used changes the count or adds a moderator rather than adding a new reason
+def _get_report_fingerprint(content):
+    report_summary = sorted(
+        [("mod", str(report[0]), str(report[1])) for report in content["mod_reports"]] +
+        [("user", str(report[0]), str(report[1])) for report in content["user_reports"]]
+    )
+    return hashlib.sha1(repr(report_summary).encode("utf-8")).hexdigest()
 
-    # Log the report to the user and to the post, the report date, and permalink to reported content
-    if user_status != constants.RedditUserUpsertStatus.MISSING.value:
-        await _add_and_update_user_reports(content)
 
+# Logs all of an author's new reports to the author in a single write, inserting them if they are not already in the
+#   database. Suspended users are not added due to missing required userdata
+# Note: If changing schema here, also change in _add_new_user_to_db()
+async def _log_user_reported_content(username, user_reported_content):
+    try:
+        userdata = await praw_operations.get_loaded_redditor(username, constants.RedditRequestPriority.INGESTION)
+    except Exception as e:
+        print("Failed to load reported user {}: {}".format(username, e))
+        return
+    if hasattr(userdata, 'is_suspended') and userdata.is_suspended:
+        return
 
-# Add user report to user
-# Note: If changing schema here, also change in _add_or_update_user_db()
-async def _add_and_update_user_reports(content):
-    username = content["author"].name
-    userdata = await praw_operations.get_redditor(username)
-    await userdata.load()
     id_object = {"_id": userdata.id}
-
-    # Insert user if they are not already in the database
-    if db.users.find_one(id_object) is None:
-        _add_new_user_to_db(username, userdata)
-
-    # Create new report object from this report
-    report_object = _construct_report(content)
-    # We can remove the username since we are associating this report to the user
-    report_object.pop('username', None)
-
-    # Fetch user reports, add new report, and update existing reports
-    user = db.users.find_one(id_object)
-    user_reports = user["reports"] if "reports" in user else {}
-
-    # Check whether this post has been reported before, if so, merge report counts
-    if report_object["post_id"] in user_reports:
-        stored_reports_for_post = user_reports[report_object["post_id"]]["reports"]
-        stored_reports_for_post.update(report_object["reports"])
-        user_reports[report_object["post_id"]]["reports"] = stored_reports_for_post
-    else:
-        # Otherwise, create new entry in user_reports for given post
-        user_reports[report_object["post_id"]] = report_object
-
-    db.users.update(id_object, {"$set": {
-        "reports": user_reports
-    }})
+    user = db.users.find_one(id_object, {"reports": True})
+    user_reports = user["reports"] if user is not None and "reports" in user else {}
+    for content in user_reported_content:
+        # Create new report object from this report
+        report_object = _construct_report(content)
+        # We can remove the username since we are associating this report to the user
+        report_object.pop('username', None)
+
+        # Check whether this post has been reported before, if so, merge report counts
+        if report_object["post_id"] in user_reports:
+            user_reports[report_object["post_id"]]["reports"].update(report_object["reports"])
+        else:
+            # Otherwise, create new entry in user_reports for given post
+            user_reports[report_object["post_id"]] = report_object
+
+    db.users.update_one(id_object, {
+        "$set": {
+            "account_creation_utc": userdata.created_utc,
+            "icon_img": userdata.icon_img,
+            "comment_karma": userdata.comment_karma,
+            "link_karma": userdata.link_karma,
+            "reports": user_reports,
+        },
+        "$setOnInsert": {
+            "username": username,
+            "mod_comments": [],
+            "tags": [],
+        },
+    }, upsert=True)
 
 
 # Reports contain both the report reasoning/message (0), and the author of the reported content (1)
@@ -388,7 +506,7 @@ def _construct_report(content):
     return {
         "post_id": content["post_id"],
         "post_type": content["post_type"],
-        "username": content["author"].name,
+        "username": content["author"].name if content["author"] is not None else constants.StringConstants.DELETED_AUTHOR.value,
         "content": content["title"] if content["post_type"] == constants.PostTypes.REDDIT_SUBMISSION.value else content["body"],
         "timestamp": praw_operations.convert_created_utc_to_ts(content["created_utc"]),
         "permalink": content["permalink"],
@@ -1,14 +1,17 @@
 import re
+import time
+import asyncio
 import datetime
-import prawcore
 import discord
 import logging
-from discord.ext import tasks, commands
+from discord.ext import commands
 
 # File imports
+import classes
 import constants
 import praw_operations
 import filters
+import advanced_filters
 import wrangler
 import user_preferences
 import db_collection_operations
@@ -35,15 +38,6 @@ def set_filters():
     return output_filters
 
 
-# Initialize metadata information
-def set_metadata():
-    retrieved_metadata = db_collection_operations.get_collection("metadata")
-    metadata_dict = {}
-    for metadata in retrieved_metadata:
-        metadata_dict[metadata["name"]] = metadata
-    return metadata_dict
-
-
 # Return roles matching names in roles_to_find
 def find_roles(roles, roles_to_find):
     found_roles = []
@@ -57,6 +51,44 @@ def get_roles():
     return client.guilds[0].roles
 
 
+# Collects runtime statistics to be displayed by the stats command
+def get_stats_lines():
+    redditor_cache_stats = praw_operations.redditor_cache.stats()
+    stats_lines = [
+        "Redditor cache: {} hits / {} misses ({:.0%} hit rate), {} profiles cached".format(
+            redditor_cache_stats["hits"], redditor_cache_stats["misses"],
+            redditor_cache_stats["hit_rate"], redditor_cache_stats["size"]),
+    ]
+    history_scan_stats = praw_operations.user_history_verdict_cache.stats()
+    stats_lines.append("User history scans: {} reused / {} scanned ({:.0%} reused)".format(
+        history_scan_stats["hits"], history_scan_stats["misses"], history_scan_stats["hit_rate"]))
+    rate_budget_stats = praw_operations.get_rate_budget_stats()
+    remaining_requests = rate_budget_stats["remaining_requests"]
+    stats_lines.append("Reddit rate budget: {:.1f} requests available, {} remaining this window, {} queued".format(
+        rate_budget_stats["tokens"], "unknown" if remaining_requests is None else int(remaining_requests),
+        rate_budget_stats["queue_depth"]))
+    mod_action_stats = praw_operations.mod_action_queue.stats()
+    stats_lines.append("Mod actions: {} queued, {} duplicates coalesced, {} replaced by opposite actions".format(
+        mod_action_stats["queue_depth"], mod_action_stats["coalesced"], mod_action_stats["replaced"]))
+    for action, action_stats in mod_action_stats["actions"].items():
+        stats_lines.append("  {}: {} succeeded / {} failed, {:.2f}s average latency, {:.2f}s max".format(
+            action, action_stats["succeeded"], action_stats["failed"],
+            action_stats["average_latency"], action_stats["max_latency"]))
+    for filter_type, inference_stats in advanced_filters.get_advanced_filter_stats().items():
+        stats_lines.append("{}: {} batches queued, {} classified ({} timed out, {} failed), "
+                           "{:.2f}s average latency, {:.2f}s max".format(
+                               filter_type, inference_stats["queue_depth"], inference_stats["requests"],
+                               inference_stats["timeouts"], inference_stats["failures"],
+                               inference_stats["average_latency"], inference_stats["max_latency"]))
+        stats_lines.append("  Result cache: {} hits / {} misses ({:.0%} hit rate, {} from disk), {} results cached".format(
+            inference_stats["cache"]["hits"], inference_stats["cache"]["misses"], inference_stats["cache"]["hit_rate"],
+            inference_stats["persisted_cache_hits"], inference_stats["cache"]["size"]))
+    for subreddit_name, poll_interval in subreddit_poll_intervals.items():
+        stats_lines.append("r/{}: polling every {:.1f} min, {:.1f} new items/min".format(
+            subreddit_name, poll_interval.interval_minutes, poll_interval.new_items_per_minute))
+    return stats_lines
+
+
 # ==============
 # INITIALIZATION
 # ==============
@@ -77,7 +109,20 @@ client = commands.Bot(
     command_prefix=user_preferences.Settings.BOT_PREFIX.value
 )
 db_filters = set_filters()
-metadata_dict = set_metadata()
+db_filter_dispatch = filters.build_filter_dispatch(db_filters)
+# Time filters were last refreshed from the database
+filters_refresh_time = time.monotonic()
+
+# Polling and streaming tasks of each subreddit, keyed by (subreddit name, task name)
+subreddit_tasks = {}
+# Adaptive poll interval of each subreddit, keyed by subreddit name (only used if BotConsts.ADAPTIVE_POLLING is enabled)
+subreddit_poll_intervals = {}
+# Number of posts of each type requested when polling a subreddit
+poll_chunk_size = 10
+
+# Limits the number of listing queries running at once across every subreddit, created on first use so that it is bound
+#   to the running event loop
+poll_semaphore = None
 
 # =====================
 # GENERIC BOT FUNCTIONS
@@ -90,19 +135,86 @@ async def on_ready():
     print('Discord Logged in as', client.user)
     await client.change_presence(activity=discord.Game(name='My prefix is {}'.format(user_preferences.Settings.BOT_PREFIX.value)))
     await send_health_message(constants.BotHealthMessages.POLLING_START.value)
-    await run_loop_tasks.start()
+    advanced_filters.load_advanced_filters()
+    start_subreddit_poll_loops()
 
 
-@tasks.loop(minutes=user_preferences.BotConsts.POLL_TIMER.value)
-async def run_loop_tasks():
-    # Poll for new posts
-    try:
-        await poll_new_posts()
-    except (StopIteration, prawcore.exceptions.NotFound) as error:
-        print("Polling task ran into an error: " + error)
+# Starts a polling loop for each subreddit, along with stream consumers for subreddits that use streaming, unless they
+#   are already running (on_ready can fire again on reconnect)
+def start_subreddit_poll_loops():
+    for subreddit_and_channels in SelectedSubredditsAndChannels:
+        start_subreddit_task(subreddit_and_channels, "poll", poll_subreddit_and_get_next_poll_timer)
+        if subreddit_and_channels.use_streaming:
+            start_subreddit_task(subreddit_and_channels, constants.PostTypes.REDDIT_SUBMISSION.value,
+                                 consume_subreddit_stream, constants.PostTypes.REDDIT_SUBMISSION)
+            start_subreddit_task(subreddit_and_channels, constants.PostTypes.REDDIT_COMMENT.value,
+                                 consume_subreddit_stream, constants.PostTypes.REDDIT_COMMENT)
 
-    # Poll for new reports
-    await poll_new_reports()
+
+def start_subreddit_task(subreddit_and_channels, task_name, task_function, *args):
+    task_key = (subreddit_and_channels.subreddit, task_name)
+    subreddit_task = subreddit_tasks.get(task_key)
+    if subreddit_task is None or subreddit_task.done():
+        subreddit_tasks[task_key] = asyncio.ensure_future(
+            run_supervised_loop(subreddit_and_channels, task_function, *args))
+
+
+# Minutes between polls of a subreddit, subreddits without their own poll timer use BotConsts.POLL_TIMER
+def get_poll_timer(subreddit_and_channels):
+    if subreddit_and_channels.poll_timer is not None:
+        return subreddit_and_channels.poll_timer
+    return user_preferences.BotConsts.POLL_TIMER.value
+
+
+# Records the result of a poll and returns the minutes until the subreddit should be polled again
+# With adaptive polling, the interval starts at the subreddit's poll timer and follows the subreddit's activity
+def get_next_poll_timer(subreddit_and_channels, new_posts):
+    if not user_preferences.BotConsts.ADAPTIVE_POLLING.value:
+        return get_poll_timer(subreddit_and_channels)
+
+    subreddit_name = subreddit_and_channels.subreddit
+    if subreddit_name not in subreddit_poll_intervals:
+        subreddit_poll_intervals[subreddit_name] = classes.AdaptivePollInterval(
+            get_poll_timer(subreddit_and_channels),
+            user_preferences.BotConsts.MIN_POLL_TIMER.value,
+            user_preferences.BotConsts.MAX_POLL_TIMER.value
+        )
+    poll_interval = subreddit_poll_intervals[subreddit_name]
+    num_new_submissions = len([post for post in new_posts
+                               if post["post_type"] == constants.PostTypes.REDDIT_SUBMISSION.value])
+    num_new_comments = len(new_posts) - num_new_submissions
+    is_chunk_full = num_new_submissions >= poll_chunk_size or num_new_comments >= poll_chunk_size
+    next_poll_timer = poll_interval.record_poll(len(new_posts), is_chunk_full)
+    print("r/{}: {:.1f} new items/min, next poll in {:.1f} min".format(
+        subreddit_name, poll_interval.new_items_per_minute, next_poll_timer))
+    return next_poll_timer
+
+
+# Repeatedly runs task_function, which returns the number of minutes to wait before running it again. If it fails, only
+#   this subreddit's task is affected: the failure is reported to its status channels and the task is restarted after an
+#   exponential backoff (reset once the task has run for longer than the maximum backoff)
+async def run_supervised_loop(subreddit_and_channels, task_function, *args):
+    consecutive_failures = 0
+    while True:
+        start_time = time.monotonic()
+        try:
+            wait_minutes = await task_function(subreddit_and_channels, *args)
+            consecutive_failures = 0
+        except Exception as error:
+            if time.monotonic() - start_time > user_preferences.BotConsts.POLL_RESTART_BACKOFF_MAX.value * 60:
+                consecutive_failures = 0
+            consecutive_failures += 1
+            wait_minutes = min(
+                user_preferences.BotConsts.POLL_RESTART_BACKOFF.value * 2 ** (consecutive_failures - 1),
+                user_preferences.BotConsts.POLL_RESTART_BACKOFF_MAX.value
+            )
+            print("Polling r/{} ran into an error: {}".format(subreddit_and_channels.subreddit, error))
+            await send_status_message(
+                subreddit_and_channels,
+                constants.BotHealthMessages.POLL_FAILED.value.format(subreddit_and_channels.subreddit, error)
+            )
+            await send_status_message(subreddit_and_channels, constants.BotHealthMessages.TASK_FAILED_AND_RESTART.value)
+        await asyncio.sleep(wait_minutes * 60)
 
 
 async def send_health_message(message):
@@ -113,13 +225,12 @@ async def send_health_message(message):
             await current_channel.send(content=message)
 
 
-# Handle loop failures by restarting polling
-@run_loop_tasks.after_loop
-async def on_poll_error():
-    if run_loop_tasks.is_being_cancelled() or run_loop_tasks.failed():
-        await send_health_message(constants.BotHealthMessages.TASK_FAILED_AND_RESTART.value)
-        run_loop_tasks.cancel()
-        run_loop_tasks.restart()
+# Sends a message to a subreddit's status channels, failures are only printed so they cannot interrupt polling
+async def send_status_message(subreddit_and_channels, message):
+    try:
+        await send_message_to_channels(subreddit_and_channels.status_channel_ids, message)
+    except Exception as error:
+        print("Failed to send status message for r/{}: {}".format(subreddit_and_channels.subreddit, error))
 
 
 def get_channel_from_id(channel_id):
@@ -159,7 +270,8 @@ def get_post_id(id_or_url):
     if is_entry_url:
         post_id = get_post_id_from_url(id_or_url)
     else:
-        post_id = id_or_url
+        # Posts are stored by their bare ID, so any fullname prefix (t3_, t1_) is dropped
+        post_id = praw_operations.split_post_fullname(id_or_url)[0]
     return post_id
 
 
@@ -211,26 +323,93 @@ def is_match_valid_regex(regex):
 # REDDIT POST POLLING
 # ===================
 
-# Grabs new posts, stores them in the database
-async def poll_new_posts():
-    await send_health_message(constants.BotHealthMessages.POLLING_UP.value)
-    for subreddit_and_channels in SelectedSubredditsAndChannels:
-        await get_new_reddit_posts(10, subreddit_and_channels)
+def get_poll_semaphore():
+    global poll_semaphore
+    if poll_semaphore is None:
+        poll_semaphore = asyncio.Semaphore(user_preferences.BotConsts.POLL_CONCURRENCY.value)
+    return poll_semaphore
+
+
+# Refreshes filters from the database
+def refresh_filters():
+    global db_filters
+    global db_filter_dispatch
+    global filters_refresh_time
+    db_filters = set_filters()
+    db_filter_dispatch = filters.build_filter_dispatch(db_filters)
+    filters_refresh_time = time.monotonic()
+
+
+# Refreshes filters if they were last refreshed more than FILTER_REFRESH_TIMER minutes ago, so that they are
+#   reloaded once per interval however many subreddits are polled
+def refresh_filters_if_stale():
+    if time.monotonic() - filters_refresh_time >= user_preferences.BotConsts.FILTER_REFRESH_TIMER.value * 60:
+        refresh_filters()
+
+
+async def poll_subreddit_and_get_next_poll_timer(subreddit_and_channels):
+    new_posts = await poll_subreddit(subreddit_and_channels)
+    return get_next_poll_timer(subreddit_and_channels, new_posts)
+
+
+# Runs a single poll of a subreddit: grabs new posts and stores them in the database, then checks for new reports
+# Subreddits that use streaming are still polled for posts, which catches up on anything the streams missed while
+#   they were restarting
+async def poll_subreddit(subreddit_and_channels):
+    subreddit_name = subreddit_and_channels.subreddit
+    refresh_filters_if_stale()
+
+    start_time = time.monotonic()
+    # The ignore buffer is shared by every subreddit, so it is read fresh for each poll and only this subreddit's posts
+    #   are removed from it once they have been polled
+    ignore_buffer_items = db_collection_operations.get_ignore_buffer()["items"]
+    new_posts = await get_new_reddit_posts(poll_chunk_size, subreddit_and_channels, ignore_buffer_items)
+    db_collection_operations.remove_subreddit_posts_from_ignore_buffer(
+        subreddit_name, ignore_buffer_items,
+        [polled_subreddit.subreddit for polled_subreddit in SelectedSubredditsAndChannels]
+    )
+    await send_status_message(
+        subreddit_and_channels,
+        constants.BotHealthMessages.POLL_COMPLETE.value.format(
+            subreddit_name, time.monotonic() - start_time, len(new_posts))
+    )
+
+    if subreddit_and_channels.has_mod:
+        await poll_subreddit_reports(subreddit_and_channels)
+    return new_posts
+
+
+# Consumes a subreddit's submission or comment stream, sending new posts through the same pipeline as polled posts in
+#   micro-batches. A batch is processed once the stream has no more items waiting or STREAM_BATCH_SIZE items are collected
+# Streamed posts do not move the high water mark, the stream skips posts made while it was restarting and can fall behind
+#   a busy subreddit, so polling catches up from the newest post it processed itself. Posts the stream already stored are
+#   not processed again by polling
+async def consume_subreddit_stream(subreddit_and_channels, post_type):
+    subreddit_name = subreddit_and_channels.subreddit
+    batch = []
+    stream = await praw_operations.stream_posts(post_type, subreddit_name)
+    async for post in stream:
+        if post is not None:
+            batch.append(post)
+        if len(batch) > 0 and (post is None or len(batch) >= user_preferences.BotConsts.STREAM_BATCH_SIZE.value):
+            new_posts = await praw_operations.store_streamed_posts(batch, post_type, subreddit_name)
+            await process_new_posts(new_posts, subreddit_and_channels)
+            batch = []
+    # Restart immediately if the stream ends
+    return 0
 
 
 # Fetches new reports, stores in database, pings on new reports
-async def poll_new_reports():
-    for subreddit_and_channels in SelectedSubredditsAndChannels:
-        if subreddit_and_channels.has_mod:
-            subreddit_name = subreddit_and_channels.subreddit
-            raw_reports = await praw_operations.fetch_latest_reports(subreddit_name)
-            # New reports is cleaned again using db_collection_operations._construct_report() to create
-            #   a unified format for both submissions and comments to be used for the output embed messages
-            new_reports = await db_collection_operations.db_operations_on_reported_content(subreddit_name, raw_reports)
-            if len(new_reports) != 0:
-                print("New Reports Found...")
-            for new_report in new_reports:
-                await send_report_message(subreddit_and_channels, new_report)
+async def poll_subreddit_reports(subreddit_and_channels):
+    subreddit_name = subreddit_and_channels.subreddit
+    raw_reports = await praw_operations.fetch_latest_reports(subreddit_name)
+    # New reports is cleaned again using db_collection_operations._construct_report() to create
+    #   a unified format for both submissions and comments to be used for the output embed messages
+    new_reports = await db_collection_operations.db_operations_on_reported_content(subreddit_name, raw_reports)
+    if len(new_reports) != 0:
+        print("New Reports Found...")
+    for new_report in new_reports:
+        await send_report_message(subreddit_and_channels, new_report)
 
 
 async def send_report_message(subreddit_and_channels, report):
@@ -357,32 +536,44 @@ async def actions_on_post(post_and_matches, subreddit_and_channels):
     if priority_action == constants.FilterActions.REMOVE.value and subreddit_and_channels.has_mod:
         post_id = post_and_matches["post"]["_id"]
         post_type = post_and_matches["post"]["post_type"]
-        await praw_operations.action_on_post(post_id, constants.RedditOperationTypes.REMOVE.value, post_type)
+        praw_operations.enqueue_mod_action(post_id, constants.RedditOperationTypes.REMOVE.value, post_type,
+                                           constants.RedditRequestPriority.INGESTION)
         await send_message_to_channels(subreddit_and_channels.ping_channel_ids, constants.FilterActions.REMOVE_MESSAGE.value)
 
     # TODO: Integrate priority action into ping message so we know what action is taken
     await send_message_and_potentially_ping(post_and_matches, subreddit_and_channels)
 
 
-# Gets all new Reddit posts and stores them in the database
-async def get_new_reddit_posts(num_posts, subreddit_and_channels):
-    # Refresh filters on each poll
-    global db_filters
-    global metadata_dict
-    db_filters = set_filters()
-    metadata_dict = set_metadata()
+# Gets and stores new posts of a single type, starting from and then advancing the stored high water mark
+async def get_and_store_new_posts_of_type(num_posts, post_type, subreddit_name, ignore_buffer_items):
+    high_water_mark = db_collection_operations.get_post_high_water_mark(subreddit_name, post_type)
+    async with get_poll_semaphore():
+        new_posts = await praw_operations.get_and_store_unstored(
+            num_posts, post_type, subreddit_name, ignore_buffer_items, high_water_mark
+        )
+    db_collection_operations.update_post_high_water_mark(subreddit_name, post_type, new_posts)
+    return new_posts
+
 
-    ignore_buffer_items = metadata_dict[constants.DatabaseMetadataInfo.IGNORE_BUFFER_NAME.value]["items"]
+# Gets all new Reddit posts and stores them in the database
+async def get_new_reddit_posts(num_posts, subreddit_and_channels, ignore_buffer_items):
     subreddit_name = subreddit_and_channels.subreddit
-    new_submissions = await praw_operations.get_and_store_unstored(
-        num_posts, constants.PostTypes.REDDIT_SUBMISSION, subreddit_name, ignore_buffer_items
-    )
-    new_comments = await praw_operations.get_and_store_unstored(
-        num_posts, constants.PostTypes.REDDIT_COMMENT, subreddit_name, ignore_buffer_items
+    new_submissions, new_comments = await asyncio.gather(
+        get_and_store_new_posts_of_type(
+            num_posts, constants.PostTypes.REDDIT_SUBMISSION, subreddit_name, ignore_buffer_items
+        ),
+        get_and_store_new_posts_of_type(
+            num_posts, constants.PostTypes.REDDIT_COMMENT, subreddit_name, ignore_buffer_items
+        )
     )
     new_posts = praw_operations.sort_by_created_time(new_submissions + new_comments, False)
+    await process_new_posts(new_posts, subreddit_and_channels)
+    return new_posts
+
 
-    db_collection_operations.clear_ignore_buffer()
+# Scans new posts for blacklisted subreddit activity and reposts, then applies filters and takes the resulting actions
+async def process_new_posts(new_posts, subreddit_and_channels):
+    subreddit_name = subreddit_and_channels.subreddit
     if new_posts:
         print("{} / {} new posts found on {}".format(datetime.datetime.now(), str(len(new_posts)), subreddit_name))
         # print(new_posts)
@@ -392,8 +583,10 @@ async def get_new_reddit_posts(num_posts, subreddit_and_channels):
     # TODO: Add multi-subreddit support (send to associated channel for subreddit), consider updating classes.py
     for blacklisted_channel in user_preferences.BlacklistedChannelIds:
         blacklisted_channels.append(get_channel_from_id(blacklisted_channel))
-    for new_post in new_posts:
-        history_object = await praw_operations.scan_user_history(new_post)
+    # Users are scanned concurrently, and posts by the same user share a single scan
+    history_objects = await asyncio.gather(*[praw_operations.scan_user_history(new_post) for new_post in new_posts])
+    blacklisted_participant_posts = []
+    for new_post, history_object in zip(new_posts, history_objects):
         if len(history_object) > 0:
             # TODO: Convert to a nicer embed
             removal_message = "**BLACKLISTED SUBREDDIT ACTIVITY**\n" + "User: " +\
@@ -402,9 +595,12 @@ async def get_new_reddit_posts(num_posts, subreddit_and_channels):
                               "Blacklisted Activity: " + history_object["permalink"] + "\n" +\
                               "Current Post: " + new_post["permalink"]
             if environment_variables.REMOVE_BLACKLISTED_SUBREDDIT_PARTICIPANT_POSTS:
-                await praw_operations.action_on_post(new_post["_id"], constants.RedditOperationTypes.REMOVE.value, new_post["post_type"])
+                blacklisted_participant_posts.append(new_post)
             for channel in blacklisted_channels:
                 await channel.send(content=removal_message)
+    # Removals are queued rather than awaited so polling does not wait on them
+    praw_operations.enqueue_mod_actions(blacklisted_participant_posts, constants.RedditOperationTypes.REMOVE.value,
+                                        constants.RedditRequestPriority.INGESTION)
 
     # Check if post is a repost
     repost_channels = []
@@ -413,6 +609,7 @@ async def get_new_reddit_posts(num_posts, subreddit_and_channels):
     for repost_channel in repost_channel_ids_to_use:
         repost_channels.append(get_channel_from_id(repost_channel))
     if environment_variables.REPOST_SETTINGS["SCAN_FOR_REPOSTS"]:
+        reposts_to_remove = []
         for new_post in new_posts:
             if new_post["post_type"] != constants.PostTypes.REDDIT_SUBMISSION.value:
                 continue
@@ -421,12 +618,14 @@ async def get_new_reddit_posts(num_posts, subreddit_and_channels):
                 continue
             repost_embed = wrangler.construct_repost_embed(new_post, reposts)
             if environment_variables.REPOST_SETTINGS["DELETE_REPOSTS"]:
-                await praw_operations.action_on_post(new_post["_id"], constants.RedditOperationTypes.REMOVE.value, new_post["post_type"])
+                reposts_to_remove.append(new_post)
             for channel in repost_channels:
                 if channel is not None:
                     await channel.send(embed=repost_embed)
+        praw_operations.enqueue_mod_actions(reposts_to_remove, constants.RedditOperationTypes.REMOVE.value,
+                                            constants.RedditRequestPriority.INGESTION)
 
-    posts_and_matches = await filters.apply_all_filters(db_filters, new_posts, constants.Platforms.REDDIT.value)
+    posts_and_matches = await filters.apply_all_filters(db_filter_dispatch, new_posts, constants.Platforms.REDDIT.value)
     for post_and_matches in posts_and_matches:
         await actions_on_post(post_and_matches, subreddit_and_channels)
 
@@ -439,16 +638,10 @@ def check_message_is_from_bot(message):
     return message.author.id == client.user.id
 
 
-# Returns all comments from a post with negative karma values
+# Returns the most negative comments from a post and how much of its comment tree was scanned
 async def get_negative_comment_tree(submission):
     if submission is not None:
-        pruned_comments = []
-        comments = await praw_operations.request_sorted_comments(submission)
-        # Remove all comments >= 0 karma
-        for comment in comments:
-            if comment.score < 0:
-                pruned_comments.append(comment)
-        return pruned_comments
+        return await praw_operations.request_negative_comments(submission)
     else:
         return None
 
@@ -519,8 +712,8 @@ async def handle_reaction(reaction, user):
         elif react_emoji == constants.RedditReactEmojis.GENERATE_NEGATIVE_COMMENT_TREE.value:
             post_id = get_embed_post_id(message_main_embed)
             submission = await praw_operations.request_post(post_id, constants.PostTypes.REDDIT_SUBMISSION.value)
-            comments = await get_negative_comment_tree(submission)
-            embed_and_info = wrangler.construct_negative_comment_tree_embed(submission, comments)
+            negative_comment_tree = await get_negative_comment_tree(submission)
+            embed_and_info = wrangler.construct_negative_comment_tree_embed(submission, negative_comment_tree)
             embed = embed_and_info["embed"]
             additional_info = embed_and_info["additional_info"]
             generated_message = await message.channel.send(embed=embed)
@@ -640,6 +833,7 @@ async def add_match(context, filter_name, new_match):
     # Add match to database
     add_result = await db_collection_operations.attempt_add_or_remove_match(filter_name, new_match, constants.RedditOperationTypes.ADD.value)
     if add_result:
+        filters.update_compiled_filter(filter_name, new_match, constants.RedditOperationTypes.ADD.value)
         # If the filter should also be synced with the automoderator wiki, do it here in addition to updating database
         filter_sync_result = should_filter_be_synced(filter_name)
         automod_result = ""
@@ -668,10 +862,28 @@ async def bulk_add_match(context, filter_name, *matches):
         return
 
     if filter_name not in user_preferences.RegexFilters:
+        added_matches = []
+        failed_matches = []
         for match in matches:
             match = match.replace(",", "")
-            await add_match(context, filter_name, match)
-        await context.send("Bulk match adding complete. ")
+            add_result = await db_collection_operations.attempt_add_or_remove_match(filter_name, match, constants.RedditOperationTypes.ADD.value)
+            if add_result:
+                filters.update_compiled_filter(filter_name, match, constants.RedditOperationTypes.ADD.value)
+                added_matches.append(match)
+            else:
+                failed_matches.append(match)
+        if failed_matches:
+            await context.send("There was an issue adding {} to {}. Ensure the matches have not already been added.".format(", ".join(failed_matches), filter_name))
+
+        # All of the added matches are synced to the automoderator wiki in a single edit
+        filter_sync_result = should_filter_be_synced(filter_name)
+        if filter_sync_result is not None and added_matches:
+            automod_result = await praw_operations.update_automoderator_filter(filter_sync_result, added_matches, [])
+            if automod_result == constants.RedditAutomodEditStatus.FAIL.value:
+                await context.send("There was an issue adding {} to the Reddit automoderator page.".format(", ".join(added_matches)))
+            elif automod_result == constants.RedditAutomodEditStatus.MISSING_PRIVILEGES.value:
+                await context.send("{} could not be added to the Reddit automoderator page due to missing privileges.".format(", ".join(added_matches)))
+        await context.send("Bulk match adding complete. {} of {} matches added to {}.".format(len(added_matches), len(matches), filter_name))
     else:
         await context.send("Bulk match adding is not supported for regex filters (since commas and spaces are used to separate matches, which conflicts with regex).")
 
@@ -684,6 +896,7 @@ async def remove_match(context, filter_name, match_to_remove):
 
     remove_result = await db_collection_operations.attempt_add_or_remove_match(filter_name, match_to_remove, constants.RedditOperationTypes.REMOVE.value)
     if remove_result:
+        filters.update_compiled_filter(filter_name, match_to_remove, constants.RedditOperationTypes.REMOVE.value)
         # If the filter should also be synced with the automoderator wiki, do it here in addition to updating database
         filter_sync_result = should_filter_be_synced(filter_name)
         if filter_sync_result is not None:
@@ -828,6 +1041,12 @@ async def unsubscribe(context, role):
         await context.channel.send("Successfully removed role.")
 
 
+@client.command()
+async def stats(context):
+    for message in wrangler.truncate_message_into_code_blocks("\n".join(get_stats_lines())):
+        await context.send(message)
+
+
 @client.command()
 async def ping(context):
     await context.send("Pong!")
@@ -1,126 +1,301 @@
-import re
-
 import advanced_filters
+import classes
 import constants
 import datetime
 import db_collection_operations
 import user_preferences
 
 
+# Compiled matchers of each filter along with the version of the filter they were compiled from, keyed by filter name
+#   Regex filters are compiled into a classes.RegexPhraseMatcher and other filters into a set of their matches
+compiled_filter_cache = {}
+compiled_filter_types = [
+    constants.RedditFilterTypes.POSTS.value,
+    constants.RedditFilterTypes.USERS.value,
+    constants.RedditFilterTypes.MEDIA_SOURCE.value,
+]
+
+# Filter types that only match submissions, which are skipped entirely for comments
+submission_only_filter_types = [
+    constants.RedditFilterTypes.MEDIA_SOURCE.value,
+    constants.RedditFilterTypes.MEDIA_SOURCE_HISTORY.value,
+]
+
+
 # Apply all filters across all Reddit content
 # TODO: Consider concat instead of "matches_for_posts =" in case we want to run against multiple platforms?
-async def _filter_reddit(filters, content):
-    matches_for_posts = await _find_reddit_matches_for_posts(filters, content)
+async def _filter_reddit(filter_dispatch, content):
+    matches_for_posts = await _find_reddit_matches_for_posts(filter_dispatch, content)
     return matches_for_posts
 
 
 # Given a filter, check every new post against it
-async def _find_reddit_matches_for_posts(filters, posts):
+# Advanced filters are applied to every post that reaches them at once, since they are much faster on a batch of posts
+#   (e.g. sentiment analysis). Each post's other filters are applied up to its next advanced filter, then all posts
+#   waiting on the same advanced filter are checked together before continuing
+async def _find_reddit_matches_for_posts(filter_dispatch, posts):
+    post_evaluations = [{
+        "post": post,
+        # Only the filters that can match this type of post are applied, cheapest first
+        "filters": filter_dispatch["reddit_filters_by_post_type"][post["post_type"]],
+        "next_filter": 0,
+        # Stores the index of each triggered filter in the loaded filters along with the match (the triggered filter
+        #   and the content caught by the filter)
+        "indexed_matches": [],
+    } for post in posts]
+
+    unfinished_evaluations = post_evaluations
+    while len(unfinished_evaluations) > 0:
+        evaluations_by_advanced_filter = {}
+        for post_evaluation in unfinished_evaluations:
+            await _find_reddit_matches_for_post(filter_dispatch, post_evaluation)
+            if post_evaluation["next_filter"] < len(post_evaluation["filters"]):
+                filter_index = post_evaluation["filters"][post_evaluation["next_filter"]][0]
+                evaluations_by_advanced_filter.setdefault(filter_index, []).append(post_evaluation)
+
+        unfinished_evaluations = []
+        for filter_index, waiting_evaluations in evaluations_by_advanced_filter.items():
+            content_filter = waiting_evaluations[0]["filters"][waiting_evaluations[0]["next_filter"]][1]
+            # Result here should generally be a string that can be inserted into the filter catch "reason" message on Discord embed
+            results = await advanced_filters.apply_advanced_filter_to_posts(
+                content_filter["type"], [post_evaluation["post"] for post_evaluation in waiting_evaluations])
+            for post_evaluation, result in zip(waiting_evaluations, results):
+                filter_matches = add_matched_filter([], content_filter, result) if result is not None else []
+                if _record_filter_matches(post_evaluation, filter_index, content_filter, filter_matches):
+                    unfinished_evaluations.append(post_evaluation)
+
     matches_for_posts = []
-    for post in posts:
-        matches_for_post = await _find_reddit_matches_for_post(filters, post)
+    for post_evaluation in post_evaluations:
+        # Matches are returned in the order the filters were loaded, regardless of the order they were applied in
+        post_evaluation["indexed_matches"].sort(key=lambda indexed_match: indexed_match[0])
         matches_for_posts.append({
-            "post": post,
-            "matches": matches_for_post
+            "post": post_evaluation["post"],
+            "matches": [match for _, match in post_evaluation["indexed_matches"]]
         })
     return matches_for_posts
 
 
 # Given a post and a filter, check if it matches against any filters
-async def _find_reddit_matches_for_post(filters, post):
-    # Stores list of triggered filters and the content caught by the filters
-    matches_for_post = []
+# Applies the post's filters until reaching an advanced filter or running out of filters
+async def _find_reddit_matches_for_post(filter_dispatch, post_evaluation):
+    while post_evaluation["next_filter"] < len(post_evaluation["filters"]):
+        filter_index, content_filter, find_filter_matches = post_evaluation["filters"][post_evaluation["next_filter"]]
+        # Advanced filters are applied to the whole batch of posts by _find_reddit_matches_for_posts()
+        if find_filter_matches is None:
+            return
+        filter_matches = await find_filter_matches(content_filter, post_evaluation["post"], filter_dispatch, [])
+        if not _record_filter_matches(post_evaluation, filter_index, content_filter, filter_matches):
+            return
+
+
+# Records the matches of the post's next filter and moves on to the filter after it, returns whether any filters are
+#   left to apply to the post
+def _record_filter_matches(post_evaluation, filter_index, content_filter, filter_matches):
+    post_evaluation["indexed_matches"].extend((filter_index, match) for match in filter_matches)
+    post_evaluation["next_filter"] += 1
+    # Filters with short circuiting enabled skip the remaining filters once they decide to remove the post
+    if content_filter.get("short_circuit", False) and any(is_remove_level_match(match) for match in filter_matches):
+        post_evaluation["next_filter"] = len(post_evaluation["filters"])
+    return post_evaluation["next_filter"] < len(post_evaluation["filters"])
+
+
+# Whether the match's action is at least as high a priority as removal
+def is_remove_level_match(match):
+    match_action = match["action"]
+    if type(match_action) == dict:
+        match_action = match_action["action"]
+    action_priority = constants.ActionPriorityDictionary.get(match_action, 0)
+    return action_priority >= constants.ActionPriorityDictionary[constants.FilterActions.REMOVE.value]
+
+
+# If filter is of user filter type and user is in matches, add match
+async def _find_users_filter_matches(content_filter, post, filter_dispatch, matches_for_post):
+    compiled_filter = filter_dispatch["compiled_filters"][content_filter["name"]]
+    if compiled_filter["is_regex"]:
+        regex_phrases = compiled_filter["matcher"].phrases
+        for phrase_index in compiled_filter["matcher"].find_matching_indexes(post["author"]["username"]):
+            matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrases[phrase_index])
+    elif is_value_in_compiled_filter(post["author"]["username"], compiled_filter):
+        matches_for_post = add_matched_filter(matches_for_post, content_filter, post["author"]["username"])
+    return matches_for_post
+
+
+# If filter is of post type, check post against all regex phrases
+async def _find_posts_filter_matches(content_filter, post, filter_dispatch, matches_for_post):
+    matcher = filter_dispatch["compiled_filters"][content_filter["name"]]["matcher"]
+    title_phrase_indexes = []
+    # Submissions also have titles, so we should check the title in addition to the content of the post
+    if post["post_type"] == constants.PostTypes.REDDIT_SUBMISSION.value:
+        title_phrase_indexes = matcher.find_matching_indexes(post["title"])
+    content_phrase_indexes = matcher.find_matching_indexes(post["content"])
+    # Matches are added in phrase order, with a title match before a content match of the same phrase
+    for phrase_index in sorted(set(title_phrase_indexes + content_phrase_indexes)):
+        regex_phrase = matcher.phrases[phrase_index]
+        if phrase_index in title_phrase_indexes:
+            matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrase)
+        if phrase_index in content_phrase_indexes:
+            matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrase)
+    return matches_for_post
+
 
+async def _find_media_source_filter_matches(content_filter, post, filter_dispatch, matches_for_post):
+    if is_media_source_submission_in_filter(post, content_filter, filter_dispatch["compiled_filters"]):
+        # TODO: Refactor the flagged_content and make it more abstract to instead say the title of the channel rather than the link as the flagged match
+        matches_for_post = add_matched_filter(matches_for_post, content_filter, post["extra_info"]["media_source"])
+    return matches_for_post
+
+
+# Media source history filters keep the date each title from their parent filter was last posted in the media history
+#   collection, and match titles posted again within their cooldown
+async def _find_media_source_history_filter_matches(content_filter, post, filter_dispatch, matches_for_post):
+    parent_filter = get_parent_filter(filter_dispatch, content_filter["parent"])
+    # Check if the post is a match for a parent filter (e.g. from a verified channel)
+    if parent_filter and is_media_source_submission_in_filter(post, parent_filter, filter_dispatch["compiled_filters"]):
+        media_title = post["extra_info"]["media_title"]
+        # Media without a title (e.g. some embeds only have an author) cannot be compared, so it is not kept in the history
+        if media_title is None:
+            return matches_for_post
+        found_matches = []
+        cooldown = content_filter["action"]["cooldown"]
+        found_match = db_collection_operations.get_media_history_match(content_filter["name"], media_title)
+        # If the media has been posted before
+        if found_match:
+            match_object = compare_media_to_cooldown(found_match, post, cooldown)
+            # If the post violates the cooldown
+            if match_object["violates_cooldown"]:
+                found_matches.append(match_object)
+                db_collection_operations.upsert_media_history(
+                    content_filter["name"], media_title, post["created_time"]["utc"], cooldown)
+        # If the media is a match for the parent but hasn't been posted, add it to the media history
+        #   This is stored immediately, so subsequent posts in the same batch will check with the latest values
+        else:
+            db_collection_operations.upsert_media_history(
+                content_filter["name"], media_title, post["created_time"]["utc"], cooldown)
+
+        if len(found_matches) > 0:
+            # If we had multiple matches, get only the newest one
+            most_recent_match = get_newest_match(found_matches)
+            match_string = cooldown_media_content_string(most_recent_match)
+            matches_for_post = add_matched_filter(matches_for_post, content_filter, match_string)
+    return matches_for_post
+
+
+# TODO: Implement subreddit filters once subreddit is stored or we figure out how to do subreddit blacklist
+# Function that applies each type of Reddit filter, any other type is applied to batches of posts as an advanced filter
+reddit_filter_functions = {
+    constants.RedditFilterTypes.USERS.value: _find_users_filter_matches,
+    constants.RedditFilterTypes.POSTS.value: _find_posts_filter_matches,
+    constants.RedditFilterTypes.MEDIA_SOURCE.value: _find_media_source_filter_matches,
+    constants.RedditFilterTypes.MEDIA_SOURCE_HISTORY.value: _find_media_source_history_filter_matches,
+}
+
+
+# Builds the lookups used to apply the filters, which should be done each time the filters are loaded:
+#   - the Reddit filters that can match each type of post, cheapest first (see constants.FilterTypeCosts), along with
+#     their index in the loaded filters and the function applying each (None for advanced filters)
+#   - the filters by name, used to find the parent filters of media source history filters
+#   - the compiled matchers of the filters
+def build_filter_dispatch(filters):
+    reddit_filters = [content_filter for content_filter in filters
+                      if content_filter["platform"] == constants.Platforms.REDDIT.value]
+    filter_dispatch = {
+        "reddit_filters_by_post_type": {post_type.value: [] for post_type in constants.PostTypes},
+        "filters_by_name": {},
+        "compiled_filters": get_compiled_filters(reddit_filters),
+    }
+    for content_filter in filters:
+        filter_dispatch["filters_by_name"].setdefault(content_filter["name"], content_filter)
+    for filter_index, content_filter in enumerate(reddit_filters):
+        # Media history used to be stored in the filter itself, and is moved to its own collection when first loaded
+        if content_filter["type"] == constants.RedditFilterTypes.MEDIA_SOURCE_HISTORY.value and \
+                len(content_filter["matches"]) > 0:
+            db_collection_operations.migrate_media_history_matches(content_filter)
+        find_filter_matches = reddit_filter_functions.get(content_filter["type"])
+        for post_type in constants.PostTypes:
+            if post_type != constants.PostTypes.REDDIT_SUBMISSION and \
+                    content_filter["type"] in submission_only_filter_types:
+                continue
+            filter_dispatch["reddit_filters_by_post_type"][post_type.value].append(
+                (filter_index, content_filter, find_filter_matches))
+    most_expensive_cost = max(constants.FilterTypeCosts.values())
+    for post_type_filters in filter_dispatch["reddit_filters_by_post_type"].values():
+        post_type_filters.sort(key=lambda indexed_filter: (
+            constants.FilterTypeCosts.get(indexed_filter[1]["type"], most_expensive_cost), indexed_filter[0]))
+    return filter_dispatch
+
+
+# Returns the compiled matchers of the posts, users and media source filters, keyed by filter name. Each filter is only
+#   compiled again when its matches (or whether it is a regex or case insensitive filter) change
+def get_compiled_filters(filters):
+    compiled_filters = {}
     for content_filter in filters:
         filter_type = content_filter["type"]
-        # If content is coming from Reddit
-        if content_filter["platform"] == constants.Platforms.REDDIT.value:
-
-            # If filter is of user filter type and user is in matches, add match
-            if filter_type == constants.RedditFilterTypes.USERS.value:
-                if content_filter["name"] in user_preferences.RegexFilters:
-                    # TODO: Create a function that takes in list of regex phrases and content_filter["matches"] to modularize this and the posts regex
-                    for regex_phrase in content_filter["matches"]:
-                        if re.search(regex_phrase, post["author"]["username"]):
-                            matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrase)
-                elif post["author"]["username"] in content_filter["matches"]:
-                    matches_for_post = add_matched_filter(matches_for_post, content_filter, post["author"]["username"])
-
-            # If filter is of post type
-            elif filter_type == constants.RedditFilterTypes.POSTS.value:
-                # Check post against all regex phrases
-                for regex_phrase in content_filter["matches"]:
-                    # Submissions also have titles, so we should check the title in addition to the content of the post
-                    if post["post_type"] == constants.PostTypes.REDDIT_SUBMISSION.value:
-                        if re.search(regex_phrase, post["title"]):
-                            matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrase)
-                    if re.search(regex_phrase, post["content"]):
-                        matches_for_post = add_matched_filter(matches_for_post, content_filter, regex_phrase)
-
-            elif filter_type == constants.RedditFilterTypes.MEDIA_SOURCE.value:
-                if is_media_source_submission_in_filter(post, content_filter):
-                    # TODO: Refactor the flagged_content and make it more abstract to instead say the title of the channel rather than the link as the flagged match
-                    matches_for_post = add_matched_filter(matches_for_post, content_filter, post["extra_info"]["media_source"])
-
-            # Media source history filters have objects in their matches array that also store historical (date) data
-            #   therefore, must be treated differently
-            elif filter_type == constants.RedditFilterTypes.MEDIA_SOURCE_HISTORY.value:
-                parent_filter = get_parent_filter(filters, content_filter["parent"])
-                # Check if the post is a match for a parent filter (e.g. from a verified channel)
-                if parent_filter and is_media_source_submission_in_filter(post, parent_filter):
-                    found_matches = []
-                    media_title = post["extra_info"]["media_title"]
-                    found_match = get_history_media_title_match(media_title, content_filter["matches"])
-                    # If the media has been posted before
-                    if found_match:
-                        match_object = compare_media_to_cooldown(found_match, post, content_filter["action"]["cooldown"])
-                        # If the post violates the cooldown
-                        if match_object["violates_cooldown"]:
-                            found_matches.append(match_object)
-                            updated_matches = update_history_media_title_by_title(media_title, content_filter["matches"], post)
-                            db_collection_operations.update_media_source_history_matches(content_filter["name"], updated_matches)
-                    # If the media is a match for the parent but hasn't been posted, add it to the filter
-                    else:
-                        match_to_add = {"match": media_title, "date_added": datetime.datetime.fromtimestamp(post["created_time"]["utc"])}
-                        await db_collection_operations.attempt_add_or_remove_match(
-                            content_filter["name"], match_to_add, constants.RedditOperationTypes.ADD.value
-                        )
-                        # Since the filter values don't update until the next poll for posts, we artificially
-                        #   update it here so subsequent posts in the same batch will check with the latest values
-                        content_filter["matches"].append(match_to_add)
-
-                    if len(found_matches) > 0:
-                        # If we had multiple matches, get only the newest one
-                        most_recent_match = get_newest_match(found_matches)
-                        match_string = cooldown_media_content_string(most_recent_match)
-                        matches_for_post = add_matched_filter(matches_for_post, content_filter, match_string)
-            # TODO: Implement this once subreddit is stored or we figure out how to do subreddit blacklist
-            # elif post_filter.type == constants.RedditFilterTypes.SUBREDDITS.value and post.subreddit in post_filter.matches:
-            else:
-                # ADVANCED FILTERS
-                # Result here should generally be a string that can be inserted into the filter catch "reason" message on Discord embed
-                result = advanced_filters.apply_advanced_filter(filter_type, post)
-                if result is not None:
-                    matches_for_post = add_matched_filter(matches_for_post, content_filter, result)
-    return matches_for_post
+        if filter_type not in compiled_filter_types:
+            continue
+        is_regex = filter_type == constants.RedditFilterTypes.POSTS.value or \
+            content_filter["name"] in user_preferences.RegexFilters
+        is_case_insensitive = content_filter["name"] in user_preferences.CaseInsensitiveFilters
+        version = (filter_type, is_regex, is_case_insensitive, tuple(content_filter["matches"]))
+        cached_filter = compiled_filter_cache.get(content_filter["name"])
+        if cached_filter is None or cached_filter["version"] != version:
+            cached_filter = {
+                "version": version,
+                "is_regex": is_regex,
+                "is_case_insensitive": is_case_insensitive,
+                "matcher": classes.RegexPhraseMatcher(content_filter["matches"]) if is_regex else None,
+                "index": None if is_regex else
+                _build_match_index(content_filter["matches"], is_case_insensitive),
+            }
+            compiled_filter_cache[content_filter["name"]] = cached_filter
+        compiled_filters[content_filter["name"]] = cached_filter
+    return compiled_filters
+
 
+def _build_match_index(matches, is_case_insensitive):
+    if is_case_insensitive:
+        return frozenset(match.casefold() for match in matches)
+    return frozenset(matches)
 
-def get_history_media_title_match(media_title, filter_matches):
-    for match in filter_matches:
-        if match["match"] == media_title:
-            return match
-    return None
 
+def is_value_in_compiled_filter(value, compiled_filter):
+    if compiled_filter["is_case_insensitive"]:
+        return value.casefold() in compiled_filter["index"]
+    return value in compiled_filter["index"]
 
-def update_history_media_title_by_title(media_title, filter_matches, post):
-    for match in filter_matches:
-        if match["match"] == media_title:
-            match["date_added"] = datetime.datetime.fromtimestamp(post["created_time"]["utc"])
-    return filter_matches
 
+# Applies a match that was just added to or removed from a filter to its compiled matcher, so the filter does not need
+#   to be compiled again when it is next loaded. Filters that have not been compiled yet are left to be compiled on use
+def update_compiled_filter(filter_name, match, operation_type):
+    cached_filter = compiled_filter_cache.get(filter_name)
+    if cached_filter is None:
+        return
+    filter_type, is_regex, is_case_insensitive, matches = cached_filter["version"]
+    # Mirrors the database update, where added matches are pushed to the end and removed matches are pulled entirely
+    if operation_type == constants.RedditOperationTypes.ADD.value:
+        matches = matches + (match,)
+    elif operation_type == constants.RedditOperationTypes.REMOVE.value:
+        matches = tuple(existing_match for existing_match in matches if existing_match != match)
+    cached_filter["version"] = (filter_type, is_regex, is_case_insensitive, matches)
+    if is_regex:
+        cached_filter["matcher"] = classes.RegexPhraseMatcher(matches)
+    elif operation_type == constants.RedditOperationTypes.ADD.value:
+        cached_filter["index"] = cached_filter["index"] | _build_match_index([match], is_case_insensitive)
+    else:
+        # Another match may fold to the same value as the removed match, so the index is rebuilt from what is left
+        cached_filter["index"] = _build_match_index(matches, is_case_insensitive)
 
-def is_media_source_submission_in_filter(post, content_filter):
-    return post["post_type"] == constants.PostTypes.REDDIT_SUBMISSION.value and post["extra_info"]["media_source"] in content_filter["matches"]
+
+def is_media_source_submission_in_filter(post, content_filter, compiled_filters):
+    if post["post_type"] != constants.PostTypes.REDDIT_SUBMISSION.value:
+        return False
+    media_source = post["extra_info"]["media_source"]
+    # Submissions without embedded media have no media source
+    if media_source is None:
+        return False
+    compiled_filter = compiled_filters.get(content_filter["name"])
+    if compiled_filter is not None and not compiled_filter["is_regex"]:
+        return is_value_in_compiled_filter(media_source, compiled_filter)
+    return media_source in content_filter["matches"]
 
 
 def cooldown_media_content_string(cooldown_object):
@@ -155,11 +330,8 @@ def compare_media_to_cooldown(match, post, cooldown):
     }
 
 
-def get_parent_filter(filters, parent_filter_name):
-    for content_filter in filters:
-        if content_filter["name"] == parent_filter_name:
-            return content_filter
-    return None
+def get_parent_filter(filter_dispatch, parent_filter_name):
+    return filter_dispatch["filters_by_name"].get(parent_filter_name)
 
 
 def add_matched_filter(current_matches, new_match_filter, new_match_content):
@@ -172,9 +344,10 @@ def add_matched_filter(current_matches, new_match_filter, new_match_content):
 
 
 # Apply all filters across acquired content
-async def apply_all_filters(filters, content, content_type):
+# Filters are passed as built by build_filter_dispatch()
+async def apply_all_filters(filter_dispatch, content, content_type):
     matches_for_content = []
     # If content is Reddit specific, call the Reddit specific filtering process
     if content_type == constants.Platforms.REDDIT.value:
-        matches_for_content = await _filter_reddit(filters, content)
+        matches_for_content = await _filter_reddit(filter_dispatch, content)
     return matches_for_content
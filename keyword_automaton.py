@@ -0,0 +1,103 @@
+import collections
+
+# pyahocorasick is optional (see requirements_optional.txt), the pure Python automaton below is used without it
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# Characters that have a special meaning in a regex phrase
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+# Returns the text a regex phrase matches if it only matches that exact text (e.g. "badword" or "example\.com"),
+#   otherwise None. Backslashes are only allowed to escape punctuation and spaces, since escaped letters and digits are
+#   classes (\d, \w) or backreferences (\1)
+def get_literal_of_regex_phrase(regex_phrase):
+    literal_characters = []
+    is_escaped = False
+    for character in regex_phrase:
+        if is_escaped:
+            if character.isalnum():
+                return None
+            literal_characters.append(character)
+            is_escaped = False
+        elif character == "\\":
+            is_escaped = True
+        elif character in REGEX_METACHARACTERS:
+            return None
+        else:
+            literal_characters.append(character)
+    if is_escaped or len(literal_characters) == 0:
+        return None
+    return "".join(literal_characters)
+
+
+# Aho-Corasick automaton that finds every keyword contained in a text with a single pass over the text
+# Each keyword is given with a value, and searching returns the values of all keywords found
+class KeywordAutomaton:
+    def __init__(self, keywords_and_values):
+        self.keyword_values = collections.defaultdict(list)
+        for keyword, value in keywords_and_values:
+            self.keyword_values[keyword].append(value)
+        self.uses_pyahocorasick = ahocorasick is not None
+        if self.uses_pyahocorasick:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, values in self.keyword_values.items():
+                self._automaton.add_word(keyword, values)
+            if len(self.keyword_values) > 0:
+                self._automaton.make_automaton()
+        else:
+            self._build()
+
+    # Builds the keyword trie, then links each node to the node of its longest proper suffix in the trie (breadth
+    #   first), so that searching can continue after a mismatch without going back in the text
+    def _build(self):
+        self._transitions = [{}]
+        self._failure_links = [0]
+        self._outputs = [[]]
+        for keyword, values in self.keyword_values.items():
+            node = 0
+            for character in keyword:
+                if character not in self._transitions[node]:
+                    self._transitions.append({})
+                    self._failure_links.append(0)
+                    self._outputs.append([])
+                    self._transitions[node][character] = len(self._transitions) - 1
+                node = self._transitions[node][character]
+            self._outputs[node] = self._outputs[node] + values
+
+        nodes_to_link = collections.deque(self._transitions[0].values())
+        while nodes_to_link:
+            node = nodes_to_link.popleft()
+            for character, next_node in self._transitions[node].items():
+                failure_node = self._failure_links[node]
+                while failure_node != 0 and character not in self._transitions[failure_node]:
+                    failure_node = self._failure_links[failure_node]
+                self._failure_links[next_node] = self._transitions[failure_node].get(character, 0)
+                # Keywords that end at the suffix node also end here
+                self._outputs[next_node] = self._outputs[next_node] + self._outputs[self._failure_links[next_node]]
+                nodes_to_link.append(next_node)
+
+    # Returns the set of values of every keyword contained in the text
+    def find_values(self, text):
+        found_values = set()
+        if len(self.keyword_values) == 0:
+            return found_values
+        if self.uses_pyahocorasick:
+            for _, values in self._automaton.iter(text):
+                found_values.update(values)
+            return found_values
+
+        transitions = self._transitions
+        failure_links = self._failure_links
+        outputs = self._outputs
+        node = 0
+        for character in text:
+            while node != 0 and character not in transitions[node]:
+                node = failure_links[node]
+            node = transitions[node].get(character, 0)
+            if outputs[node]:
+                found_values.update(outputs[node])
+        return found_values
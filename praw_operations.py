@@ -1,13 +1,19 @@
 import re
+import time
+import heapq
+import asyncio
 import asyncpraw as praw
+from asyncpraw.models.util import stream_generator
 import asyncprawcore.exceptions
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 import constants
 import environment_variables
 import user_preferences
 import exceptions
 import wrangler
+import classes
 
 # This file provides two public functions, get_and_store_posts and get_and_store_unstored to query for new posts with
 # PRAW. All PRAW (Reddit) related operations are isolated to this file.
@@ -27,21 +33,125 @@ reddit.read_only = False
 client = MongoClient(environment_variables.DATABASE_URI)
 db = client.reddit
 
+# Limits the number of author profiles loaded at once when constructing entry objects, created on first use so that it
+#   is bound to the running event loop
+author_load_semaphore = None
+
+# API paths of the subreddit listings used when requesting posts with the "before" cursor
+subreddit_listing_paths = {
+    constants.PostTypes.REDDIT_SUBMISSION: "r/{}/new/",
+    constants.PostTypes.REDDIT_COMMENT: "r/{}/comments/",
+}
+
+# Shared budget for every Reddit request, so that interactive moderator actions are not starved by ingestion or
+#   background scans. Requests are let through in constants.RedditRequestPriority order while the budget is exhausted
+rate_budget = classes.RateBudgetScheduler(
+    user_preferences.BotConsts.REDDIT_RATE_BUDGET_BURST.value,
+    user_preferences.BotConsts.REDDIT_REQUESTS_PER_MINUTE.value / 60
+)
+
+# Moderator actions are sent from this queue so that polling does not wait on them, and repeated requests for the same
+#   action on the same post (e.g. several moderators reacting at once) only act once. Actions on a post are taken one at
+#   a time in the order requested, and a queued action is replaced by a later opposite action (e.g. an automatic removal
+#   still waiting when a moderator approves the post)
+mod_action_queue = classes.CoalescingActionQueue(
+    user_preferences.BotConsts.MOD_ACTION_WORKERS.value,
+    lambda action, post_id, post_type, priority: _action_on_post_instance(
+        _get_lazy_post(post_id, post_type), action, priority),
+    {
+        constants.RedditOperationTypes.APPROVE.value: constants.RedditOperationTypes.REMOVE.value,
+        constants.RedditOperationTypes.REMOVE.value: constants.RedditOperationTypes.REMOVE.value,
+        constants.RedditOperationTypes.LOCK.value: constants.RedditOperationTypes.LOCK.value,
+        constants.RedditOperationTypes.UNLOCK.value: constants.RedditOperationTypes.LOCK.value,
+    }
+)
+
+# Content and revision ID of the automoderator wiki page of each subreddit when it was last read or edited, along with
+#   a lock so that only one edit of the page is made at a time (created on first use)
+automod_config_cache = {}
+automod_config_lock = None
+
+# Blacklisted subreddit names in lower case, mapped to the names as they were configured
+blacklisted_subreddits = {subreddit.lower(): subreddit for subreddit in user_preferences.BlacklistedSubreddits}
+# Verdict of each user's latest history scan, reused for HISTORY_SCAN_VERDICT_TTL seconds. Scans of the same user that
+#   run at the same time (e.g. for several posts by one user in a batch) share a single scan
+user_history_verdict_cache = classes.TTLCache(
+    user_preferences.BotConsts.HISTORY_SCAN_CACHE_SIZE.value,
+    user_preferences.BotConsts.HISTORY_SCAN_VERDICT_TTL.value
+)
+# Newest history item scanned for each user along with the verdict at that point, so that once a verdict expires only
+#   the user's newer history has to be read. The full history is read again every HISTORY_SCAN_FULL_RESCAN_INTERVAL
+#   seconds so that a verdict can clear once the blacklisted item is deleted or is no longer in the user's recent history
+user_history_scan_marks = classes.TTLCache(user_preferences.BotConsts.HISTORY_SCAN_CACHE_SIZE.value)
+# Limits the number of user histories scanned at once, created on first use so that it is bound to the running event loop
+history_scan_semaphore = None
+
+# Comment trees of recently requested submissions, so that requesting the same submission again expands the cached tree
+#   further instead of starting over
+comment_tree_cache = classes.TTLCache(
+    user_preferences.BotConsts.COMMENT_TREE_CACHE_SIZE.value,
+    user_preferences.BotConsts.COMMENT_TREE_CACHE_TTL.value
+)
+
+# Shared cache of loaded redditor profiles so the same user is only requested from Reddit once per REDDITOR_CACHE_TTL
+redditor_cache = classes.TTLCache(
+    user_preferences.BotConsts.REDDITOR_CACHE_SIZE.value,
+    user_preferences.BotConsts.REDDITOR_CACHE_TTL.value
+)
+
+
+# Waits until the shared rate budget allows a request of the given constants.RedditRequestPriority
+# Listings are requested at most 100 items (a single request) at a time, so each PRAW call acquires once
+async def _acquire_rate_budget(priority):
+    _update_rate_budget_from_headers()
+    await rate_budget.acquire(priority.value)
+
+
+# Reads the remaining requests and reset time that PRAW recorded from Reddit's X-Ratelimit headers
+def _update_rate_budget_from_headers():
+    rate_limiter = getattr(getattr(reddit, "_core", None), "_rate_limiter", None)
+    remaining_requests = getattr(rate_limiter, "remaining", None)
+    reset_timestamp = getattr(rate_limiter, "reset_timestamp", None)
+    if remaining_requests is not None and reset_timestamp is not None:
+        rate_budget.update_from_headers(remaining_requests, reset_timestamp - time.time())
+
+
+def get_rate_budget_stats():
+    _update_rate_budget_from_headers()
+    return rate_budget.stats()
+
 
 # It is safe to check if name starts with t3, it is a submission, and t1 are comments
 def is_post_submission(post):
-    raw_name = post.name
-    tag = raw_name[:2]
-    return tag == "t3"
+    return post.name.startswith(constants.RedditFullnamePrefixes.REDDIT_SUBMISSION.value)
+
+
+# Returns the fullname (ID prefixed with t3_ for submissions or t1_ for comments) of an entry object
+def get_entry_object_fullname(entry_object):
+    return get_post_fullname(entry_object["_id"], entry_object["post_type"])
+
+
+def get_post_fullname(post_id, post_type):
+    return constants.RedditFullnamePrefixes[constants.PostTypes(post_type).name].value + post_id
+
+
+# Splits a post ID into its bare ID and post type, or a post type of None if the ID has no fullname prefix
+def split_post_fullname(post_id):
+    for prefix in constants.RedditFullnamePrefixes:
+        if post_id.startswith(prefix.value):
+            return post_id[len(prefix.value):], constants.PostTypes[prefix.name]
+    return post_id, None
 
 
 # Gets the raw PRAW generator, and returns a list of submissions or comments
-async def _get_posts(num_posts, posts_type, subreddit_name):
+# Params are passed through to the listing (e.g. {"after": fullname} to page past a post)
+async def _get_posts(num_posts, posts_type, subreddit_name, params=None):
     subreddit = await reddit.subreddit(subreddit_name)
+    await _acquire_rate_budget(constants.RedditRequestPriority.INGESTION)
     if posts_type == constants.PostTypes.REDDIT_SUBMISSION:
-        return await _convert_listing_generator_to_list(subreddit.new(limit=num_posts))
+        return await _convert_listing_generator_to_list(subreddit.new(limit=num_posts, params=params))
     elif posts_type == constants.PostTypes.REDDIT_COMMENT:
-        return await _convert_listing_generator_to_list(subreddit.comments(limit=num_posts))
+        return await _convert_listing_generator_to_list(subreddit.comments(limit=num_posts, params=params))
 
 
 def create_invalid_author(author):
@@ -49,6 +159,16 @@ def create_invalid_author(author):
     return author
 
 
+# Requests a single page of the posts immediately newer than the "before" fullname, newest first
+# The listing is requested directly rather than through a ListingGenerator, which would continue paging into older posts
+async def _get_posts_before(num_posts, posts_type, subreddit_name, before):
+    await _acquire_rate_budget(constants.RedditRequestPriority.INGESTION)
+    listing = await reddit.get(
+        subreddit_listing_paths[posts_type].format(subreddit_name), params={"before": before, "limit": num_posts}
+    )
+    return list(listing)
+
+
 async def _convert_listing_generator_to_list(generator):
     output_list = []
     async for item in generator:
@@ -67,15 +187,16 @@ async def construct_entry_object(subreddit_name, post, post_type):
     content = ""
     if post.author is not None:
         author = post.author
+        try:
+            author = await get_loaded_redditor(author.name)
+        except asyncprawcore.exceptions.NotFound:
+            author = create_invalid_author(author)
+        # Suspended and deleted accounts are missing profile information
         if not hasattr(author, 'id'):
             author.id = 'NO_ID'
             author.icon_img = ''
             author.comment_karma = 0
             author.link_karma = 0
-        try:
-            await author.load()
-        except asyncprawcore.exceptions.NotFound:
-            author = create_invalid_author(author)
         if post_type == constants.PostTypes.REDDIT_SUBMISSION:
             if post.selftext:
                 content = post.selftext
@@ -149,76 +270,214 @@ async def construct_entry_object(subreddit_name, post, post_type):
         return None
 
 
+def _get_author_load_semaphore():
+    global author_load_semaphore
+    if author_load_semaphore is None:
+        author_load_semaphore = asyncio.Semaphore(user_preferences.BotConsts.AUTHOR_LOAD_CONCURRENCY.value)
+    return author_load_semaphore
+
+
+async def _construct_entry_object_with_limit(subreddit_name, post, post_type):
+    async with _get_author_load_semaphore():
+        return await construct_entry_object(subreddit_name, post, post_type)
+
+
+# Constructs entry objects for a batch of posts, loading authors concurrently (bounded by AUTHOR_LOAD_CONCURRENCY)
+# Output order matches the order of the posts passed in
+async def construct_entry_objects(subreddit_name, posts, post_type):
+    start_time = time.monotonic()
+    entry_objects = await asyncio.gather(
+        *[_construct_entry_object_with_limit(subreddit_name, post, post_type) for post in posts]
+    )
+    if posts:
+        print("Constructed {} {} entry objects for r/{} in {:.2f}s".format(
+            len(posts), post_type.value, subreddit_name, time.monotonic() - start_time))
+    return list(entry_objects)
+
+
 # Attempts to store each entry object in database with helper function, returns a list of all successfully stored posts
-def store_entry_objects(entry_objects, posts_type):
-    posts_stored = []
-    for entry_object in entry_objects:
-        if not _is_post_in_db(entry_object, posts_type):
-            _store_entry_object_helper(entry_object, posts_type)
-            posts_stored.append(entry_object)
-    return posts_stored
+# The existence check can be skipped for posts known to be unprocessed, posts that turn out to be stored are still skipped
+def store_entry_objects(entry_objects, posts_type, skip_existence_check=False):
+    if not skip_existence_check:
+        stored_post_ids = _get_stored_post_ids([entry_object["_id"] for entry_object in entry_objects], posts_type)
+        entry_objects = [entry_object for entry_object in entry_objects if entry_object["_id"] not in stored_post_ids]
+    return _store_entry_objects_helper(entry_objects, posts_type)
 
 
-# Stores a single entry object into the database
-def _store_entry_object_helper(entry_object, post_type):
+def _get_post_collection(post_type):
     if post_type == constants.PostTypes.REDDIT_SUBMISSION:
-        db.submissions.insert_one(entry_object)
+        return db.submissions
     elif post_type == constants.PostTypes.REDDIT_COMMENT:
-        db.comments.insert_one(entry_object)
-
-
-# Check if post is already in database, return true if it is, false if not
-def _is_post_in_db(entry_object, post_type, ignore_buffer_items=None):
-    if ignore_buffer_items is None:
-        ignore_buffer_items = []
-    post_id = entry_object["_id"]
-    # Check if the post ID is in the buffer of IDs to ignore
-    if post_id not in ignore_buffer_items:
-        id_object = {"_id": post_id}
-        queried_post = db.submissions.find_one(
-            id_object) if post_type == constants.PostTypes.REDDIT_SUBMISSION else db.comments.find_one(id_object)
-        if post_type == constants.PostTypes.REDDIT_SUBMISSION and queried_post is None:
-            return False
-        elif post_type == constants.PostTypes.REDDIT_COMMENT and queried_post is None:
-            return False
-        return True
-    else:
-        return False
+        return db.comments
+
+
+# Stores entry objects with a single unordered insert, returns the entry objects that were not already stored
+def _store_entry_objects_helper(entry_objects, post_type):
+    if len(entry_objects) == 0:
+        return []
+    try:
+        _get_post_collection(post_type).insert_many(entry_objects, ordered=False)
+        return entry_objects
+    except BulkWriteError as error:
+        # Duplicate key errors mean the post was already stored, anything else is unexpected
+        already_stored_indexes = set()
+        for write_error in error.details["writeErrors"]:
+            if write_error["code"] != constants.DatabaseErrorCodes.DUPLICATE_KEY.value:
+                raise
+            already_stored_indexes.add(write_error["index"])
+        return [entry_object for index, entry_object in enumerate(entry_objects) if index not in already_stored_indexes]
+
+
+# Returns the set of the given post IDs that are already stored in the database using a single query
+def _get_stored_post_ids(post_ids, post_type):
+    if len(post_ids) == 0:
+        return set()
+    stored_posts = _get_post_collection(post_type).find({"_id": {"$in": post_ids}}, {"_id": 1})
+    return {stored_post["_id"] for stored_post in stored_posts}
 
 
 # Gets the number of specified posts, constructs entry objects, and stores new posts in the database
 async def get_and_store_posts(num_posts, post_type, subreddit_name):
     posts = await _get_posts(num_posts, post_type, subreddit_name)
-    entry_objects = [await construct_entry_object(subreddit_name, post, post_type) for post in posts]
+    entry_objects = await construct_entry_objects(subreddit_name, posts, post_type)
     entry_objects = remove_invalid_posts(entry_objects)
     new_posts = store_entry_objects(entry_objects, post_type)
     print("Posts retrieved")
     return new_posts
 
 
-# Will repeatedly get posts on each iteration increasing by post_chunk_size until a post was already stored
-async def get_and_store_unstored(post_chunk_size, post_type, subreddit_name, ignore_buffer_items):
-    num_queries = 1
+# Stores any posts that have not been processed yet. With a high water mark (the newest post processed on a previous
+#   poll), only posts newer than the mark are requested, otherwise (or if the mark can no longer be used as a cursor)
+#   this falls back to catching up through the newest posts
+async def get_and_store_unstored(post_chunk_size, post_type, subreddit_name, ignore_buffer_items, high_water_mark=None):
+    if high_water_mark is not None:
+        new_posts = await _get_and_store_newer_than_high_water_mark(
+            post_chunk_size, post_type, subreddit_name, ignore_buffer_items, high_water_mark
+        )
+        if new_posts is not None:
+            return new_posts
+    return await _catch_up_and_store_unstored(
+        post_chunk_size, post_type, subreddit_name, ignore_buffer_items, high_water_mark
+    )
+
+
+# Pages forwards from the high water mark with the listing "before" cursor until a page is not full
+# Posts newer than the mark have not been processed, so the only existence checks needed are for posts in the ignore
+#   buffer, which were already stored when they were manually fetched
+# Returns None if the mark can no longer be used as a cursor (Reddit returns an empty listing if the post was removed)
+async def _get_and_store_newer_than_high_water_mark(post_chunk_size, post_type, subreddit_name, ignore_buffer_items,
+                                                    high_water_mark):
+    start_time = time.monotonic()
+    num_pages = 1
+    page_size = post_chunk_size
+    page = await _get_posts_before(page_size, post_type, subreddit_name, high_water_mark["id"])
+    if len(page) == 0:
+        newest_posts = await _get_posts(1, post_type, subreddit_name)
+        if len(_remove_posts_past_high_water_mark(newest_posts, high_water_mark)) > 0:
+            print("High water mark for r/{} {} is no longer in the listing".format(subreddit_name, post_type.value))
+            return None
+        return []
+
+    posts = page
+    while len(page) == page_size:
+        page_size = user_preferences.BotConsts.CATCH_UP_PAGE_SIZE.value
+        page = await _get_posts_before(page_size, post_type, subreddit_name, page[0].name)
+        num_pages += 1
+        posts = page + posts
+
+    unprocessed_posts = [post for post in posts if post.id not in ignore_buffer_items]
+    entry_objects = await construct_entry_objects(subreddit_name, unprocessed_posts, post_type)
+    entry_objects = remove_invalid_posts(entry_objects)
+    new_posts = store_entry_objects(entry_objects, post_type, skip_existence_check=True)
+    print("Querying r/{} {} complete: {} page(s), {} item(s) fetched, {} new in {:.2f}s".format(
+        subreddit_name, post_type.value, num_pages, len(posts), len(new_posts), time.monotonic() - start_time))
+    return new_posts
+
+
+# Pages backwards through the newest posts with the listing "after" cursor, continuing from where the previous page
+#   stopped, and stores any posts not already in the database. Paging stops at the high water mark, on a page where
+#   every post is already stored, or at the end of the listing.
+# The first page is post_chunk_size posts, later pages use the larger CATCH_UP_PAGE_SIZE to catch up with fewer requests
+async def _catch_up_and_store_unstored(post_chunk_size, post_type, subreddit_name, ignore_buffer_items,
+                                       high_water_mark=None):
+    start_time = time.monotonic()
+    num_pages = 0
+    num_items = 0
+    page_size = post_chunk_size
+    params = None
     new_posts = []
     while True:
-        posts = await _get_posts(post_chunk_size * num_queries, post_type, subreddit_name)
-        entry_objects = [await construct_entry_object(subreddit_name, post, post_type) for post in
-                         posts[(post_chunk_size * -1):]]
+        posts = await _get_posts(page_size, post_type, subreddit_name, params)
+        num_pages += 1
+        num_items += len(posts)
+
+        unprocessed_posts = _remove_posts_past_high_water_mark(posts, high_water_mark)
+        unstored_posts = _remove_stored_posts(unprocessed_posts, post_type, ignore_buffer_items)
+        entry_objects = await construct_entry_objects(subreddit_name, unstored_posts, post_type)
         entry_objects = remove_invalid_posts(entry_objects)
-        sorted_entry_objects = sort_by_created_time(entry_objects, False)
-        are_all_posts_stored = True
-        for entry_object in sorted_entry_objects:
-            if not _is_post_in_db(entry_object, post_type, ignore_buffer_items):
-                are_all_posts_stored = False
-        if are_all_posts_stored:
+        new_posts += store_entry_objects(entry_objects, post_type)
+
+        reached_high_water_mark = len(unprocessed_posts) < len(posts)
+        if reached_high_water_mark or len(unstored_posts) == 0 or len(posts) < page_size:
             break
-        new_posts = store_entry_objects(entry_objects, post_type)
-        print("Query " + str(num_queries) + "...")
-        num_queries += 1
-    print("Querying complete")
+        params = {"after": posts[-1].name}
+        page_size = user_preferences.BotConsts.CATCH_UP_PAGE_SIZE.value
+    print("Querying r/{} {} complete: {} page(s), {} item(s) fetched, {} new in {:.2f}s".format(
+        subreddit_name, post_type.value, num_pages, num_items, len(new_posts), time.monotonic() - start_time))
     return new_posts
 
 
+# Listings are ordered newest first, so keep posts until reaching the high water mark or a post older than it
+def _remove_posts_past_high_water_mark(posts, high_water_mark):
+    if high_water_mark is None:
+        return posts
+    output_list = []
+    for post in posts:
+        if post.name == high_water_mark["id"] or post.created_utc < high_water_mark["created_utc"]:
+            break
+        output_list.append(post)
+    return output_list
+
+
+# Removes posts that are already stored in the database (posts in the ignore buffer are never treated as stored)
+def _remove_stored_posts(posts, post_type, ignore_buffer_items):
+    stored_post_ids = _get_stored_post_ids([post.id for post in posts], post_type) - set(ignore_buffer_items)
+    return [post for post in posts if post.id not in stored_post_ids]
+
+
+# Returns a stream of new submissions or comments that yields None whenever there are no new items waiting
+# Items posted before the stream starts are skipped, polling is responsible for catching up on those
+# The stream is driven by PRAW's stream generator as with subreddit.stream, but each listing request it makes acquires
+#   from the rate budget first
+async def stream_posts(post_type, subreddit_name):
+    subreddit = await reddit.subreddit(subreddit_name)
+    if post_type == constants.PostTypes.REDDIT_SUBMISSION:
+        listing_function = subreddit.new
+    elif post_type == constants.PostTypes.REDDIT_COMMENT:
+        listing_function = subreddit.comments
+    return stream_generator(
+        _get_rate_budgeted_listing_function(listing_function, constants.RedditRequestPriority.INGESTION),
+        skip_existing=True,
+        pause_after=0
+    )
+
+
+# Wraps a listing function so that the budget is acquired before each listing it returns is requested
+def _get_rate_budgeted_listing_function(listing_function, priority):
+    async def rate_budgeted_listing_function(**listing_kwargs):
+        await _acquire_rate_budget(priority)
+        async for item in listing_function(**listing_kwargs):
+            yield item
+    return rate_budgeted_listing_function
+
+
+# Constructs and stores a batch of streamed posts, returns the posts that were not already stored (e.g. by polling)
+async def store_streamed_posts(posts, post_type, subreddit_name):
+    entry_objects = await construct_entry_objects(subreddit_name, posts, post_type)
+    entry_objects = remove_invalid_posts(entry_objects)
+    return sort_by_created_time(store_entry_objects(entry_objects, post_type), False)
+
+
 def remove_invalid_posts(post_entry_objects):
     output_list = []
     for post_entry_object in post_entry_objects:
@@ -237,6 +496,19 @@ async def get_redditor(username):
     return await reddit.redditor(username)
 
 
+async def _load_redditor(username, priority):
+    redditor = await reddit.redditor(username)
+    await _acquire_rate_budget(priority)
+    await redditor.load()
+    return redditor
+
+
+# Returns a loaded redditor through the shared profile cache, only requesting the profile from Reddit on a cache miss
+# Usernames are case-insensitive on Reddit, so they are cached case-insensitively as well
+async def get_loaded_redditor(username, priority=constants.RedditRequestPriority.INGESTION):
+    return await redditor_cache.get_or_load(username.lower(), lambda: _load_redditor(username, priority))
+
+
 # Determines the highest priority of action to be taken
 def determine_priority_action(post_and_matches):
     # Default at 0, all actions are > 0
@@ -255,71 +527,173 @@ def determine_priority_action(post_and_matches):
     return final_action
 
 
-async def request_post(post_id, post_type):
+async def request_post(post_id, post_type, priority=constants.RedditRequestPriority.INTERACTIVE):
+    await _acquire_rate_budget(priority)
     if post_type == constants.PostTypes.REDDIT_SUBMISSION.value:
         return await reddit.submission(id=post_id)
     elif post_type == constants.PostTypes.REDDIT_COMMENT.value:
         return await reddit.comment(post_id)
 
 
-# TODO: Find a better way to check if a post/comment ID is invalid
+# Looks up submissions and comments by fullname, batching as many fullnames into each request as Reddit allows
+#   Returns an object mapping the fullname of each post that was found to the post
+async def request_posts_by_fullname(fullnames, priority=constants.RedditRequestPriority.INTERACTIVE):
+    found_posts = {}
+    unique_fullnames = list(dict.fromkeys(fullnames))
+    batch_size = constants.RedditApiLimits.INFO_FULLNAMES_PER_REQUEST.value
+    for batch_start in range(0, len(unique_fullnames), batch_size):
+        await _acquire_rate_budget(priority)
+        async for post in reddit.info(fullnames=unique_fullnames[batch_start:batch_start + batch_size]):
+            found_posts[post.name] = post
+    return found_posts
+
+
 # When it is unknown whether the provided ID is a post or comment, return whatever is found
+#   Both possibilities are checked in a single request, preferring the submission if both exist
 async def attempt_to_request_post(post_id):
-    try:
-        submission_attempt = await reddit.submission(id=post_id)
-        # Dummy variable to test if accessing comments throws an exception, which it does if the post ID is invalid
-        comments = submission_attempt.comments
-        return {"post": submission_attempt, "type": constants.PostTypes.REDDIT_SUBMISSION}
-    except:
-        try:
-            comment_attempt = await reddit.comment(id=post_id)
-            return {"post": comment_attempt, "type": constants.PostTypes.REDDIT_COMMENT}
-        except:
-            raise exceptions.NoPostOrCommentFound
+    bare_post_id, post_type = split_post_fullname(post_id)
+    possible_post_types = [post_type] if post_type is not None else \
+        [constants.PostTypes.REDDIT_SUBMISSION, constants.PostTypes.REDDIT_COMMENT]
+    fullnames = [get_post_fullname(bare_post_id, possible_post_type.value) for possible_post_type in possible_post_types]
+    found_posts = await request_posts_by_fullname(fullnames)
+    for fullname, possible_post_type in zip(fullnames, possible_post_types):
+        if fullname in found_posts:
+            return {"post": found_posts[fullname], "type": possible_post_type}
+    raise exceptions.NoPostOrCommentFound
+
+
+# Returns true if any of the "load more comments" links left in a comment tree would be expanded by replace_more, the
+#   links are not known until the tree has been expanded once
+def _has_expandable_more_comments(unexpanded_more_comments):
+    if unexpanded_more_comments is None:
+        return True
+    threshold = user_preferences.BotConsts.COMMENT_TREE_REPLACE_MORE_THRESHOLD.value
+    return any(more_comments.count >= threshold for more_comments in unexpanded_more_comments)
+
+
+# Returns the most negative comments of a submission (lowest score first) along with how much of the comment tree was
+#   scanned. Each request expands at most COMMENT_TREE_REPLACE_MORE_LIMIT "load more comments" links of the submission's
+#   cached comment tree, so requesting the same submission again scans deeper into the tree
+async def request_negative_comments(submission):
+    comment_tree = comment_tree_cache.get(submission.id)
+    if comment_tree is None:
+        await _acquire_rate_budget(constants.RedditRequestPriority.INTERACTIVE)
+        comment_tree = {"comment_forest": await submission.comments(), "unexpanded_more_comments": None}
+        comment_tree_cache.set(submission.id, comment_tree)
+
+    # Expanding each link is a separate request, so links are expanded one at a time to acquire from the budget for each
+    for _ in range(user_preferences.BotConsts.COMMENT_TREE_REPLACE_MORE_LIMIT.value):
+        if not _has_expandable_more_comments(comment_tree["unexpanded_more_comments"]):
+            break
+        await _acquire_rate_budget(constants.RedditRequestPriority.INTERACTIVE)
+        comment_tree["unexpanded_more_comments"] = await comment_tree["comment_forest"].replace_more(
+            limit=1,
+            threshold=user_preferences.BotConsts.COMMENT_TREE_REPLACE_MORE_THRESHOLD.value
+        )
+
+    # Flattened list of the expanded comment tree, with any remaining "load more comments" links left out
+    comments = [comment for comment in await comment_tree["comment_forest"].list()
+                if isinstance(comment, praw.models.Comment)]
+
+    # Only as many comments as fit in an embed are kept, so select them with a heap rather than sorting every comment
+    # Comments that have been deleted (i.e. no author) are left out
+    negative_comments = heapq.nsmallest(
+        constants.CharacterLimits.EMBED_NUM_FIELDS.value,
+        [comment for comment in comments if comment.score < 0 and comment.author and comment.author.name],
+        key=lambda comment: comment.score
+    )
+    return {
+        "comments": negative_comments,
+        "num_scanned": len(comments),
+        "num_total": submission.num_comments,
+        "num_unexpanded": len(comment_tree["unexpanded_more_comments"]),
+    }
 
 
-async def request_sorted_comments(submission):
-    # Raw list of all comments (recursed through comment trees)
-    submission_comments = await submission.comments()
-    await submission_comments.replace_more(limit=None)
-    comments = await _convert_listing_generator_to_list(submission_comments)
+# Returns the automoderator wiki page and its content, only downloading the content if the page has been revised since
+#   it was last read
+async def _get_automoderator_config(subreddit_name):
+    subreddit = await reddit.subreddit(subreddit_name)
+    wikipage = praw.models.WikiPage(reddit, subreddit, constants.RedditAutomodConsts.WIKI_PAGE_NAME.value)
+    latest_revision = await _get_latest_wiki_revision(wikipage)
+    latest_revision_id = latest_revision["id"] if latest_revision is not None else None
+    cached_config = automod_config_cache.get(subreddit_name.lower())
+    if cached_config is not None and latest_revision_id is not None and \
+            cached_config["revision_id"] == latest_revision_id:
+        return {"wikipage": wikipage, "content_md": cached_config["content_md"]}
+    await _acquire_rate_budget(constants.RedditRequestPriority.INTERACTIVE)
+    await wikipage.load()
+    automod_config_cache[subreddit_name.lower()] = {"revision_id": latest_revision_id, "content_md": wikipage.content_md}
+    return {"wikipage": wikipage, "content_md": wikipage.content_md}
+
+
+async def _get_latest_wiki_revision(wikipage):
+    await _acquire_rate_budget(constants.RedditRequestPriority.INTERACTIVE)
+    async for revision in wikipage.revisions(limit=1):
+        return revision
+    return None
 
-    # Sort comments based on karma (lowest values first)
-    sorted_comments = sorted(comments, key=lambda comment: comment.score, reverse=False)
 
-    # Remove comments that have been deleted (i.e. no author)
-    tidied_list = [comment for comment in sorted_comments if comment.author and comment.author.name]
-    return tidied_list
+# Returns true if the revision is the edit the bot just made with the given reason
+def _is_own_wiki_revision(revision, reason):
+    if revision is None or revision["author"] is None:
+        return False
+    return revision["author"].name.lower() == environment_variables.REDDIT_USER_USERNAME.lower() and \
+        revision["reason"] == reason
 
 
-async def _get_automoderator_wikipage(subreddit_name):
-    subreddit = await reddit.subreddit(subreddit_name)
-    async for wikipage in subreddit.wiki:
-        if wikipage.name == "config/automoderator":
-            return await subreddit.wiki.get_page("config/automoderator")
-    return constants.RedditAutomodEditStatus.FAIL.value
+def _get_automod_config_lock():
+    global automod_config_lock
+    if automod_config_lock is None:
+        automod_config_lock = asyncio.Lock()
+    return automod_config_lock
 
 
+# Adds or removes a single match from a synced filter's rule on the automoderator wiki page
 async def update_automoderator_page(synced_filter, new_match, action):
+    if action == constants.RedditOperationTypes.ADD.value:
+        return await update_automoderator_filter(synced_filter, [new_match], [])
+    return await update_automoderator_filter(synced_filter, [], [new_match])
+
+
+# Applies a batch of match additions and removals to a synced filter's rule on the automoderator wiki page in a single
+#   edit. If any of the matches to remove cannot be found, the page is left unchanged
+async def update_automoderator_filter(synced_filter, matches_to_add, matches_to_remove):
     if environment_variables.HAS_MOD:
         filter_name = synced_filter["filter_name"]
-
-        automod_wikipage = await _get_automoderator_wikipage(environment_variables.PRIORITY_SUBREDDIT)
-        automod_filters = automod_wikipage.content_md.split(user_preferences.FilterSeparator)
-        queried_filter_and_index = get_automoderator_filter(automod_filters, filter_name)
-        if queried_filter_and_index is not None:
-            try:
-                updated_filter = update_automoderator_filter_matches(
-                    queried_filter_and_index["filter"],
-                    new_match,
-                    action
-                )
-                automod_filters[queried_filter_and_index["index"]] = updated_filter
-                updated_automod_filters = user_preferences.FilterSeparator.join(automod_filters)
-                await automod_wikipage.edit(content=updated_automod_filters, reason=synced_filter["filter_log_reason"])
-                return constants.RedditAutomodEditStatus.SUCCESS.value
-            except exceptions.AutomodRemovalNotFound:
-                return constants.RedditAutomodEditStatus.FAIL.value
+        subreddit_name = environment_variables.PRIORITY_SUBREDDIT
+
+        # Edits are made one at a time so that concurrent batches do not overwrite each other's changes
+        async with _get_automod_config_lock():
+            automod_config = await _get_automoderator_config(subreddit_name)
+            automod_filters = automod_config["content_md"].split(user_preferences.FilterSeparator)
+            queried_filter_and_index = get_automoderator_filter(automod_filters, filter_name)
+            if queried_filter_and_index is not None:
+                try:
+                    updated_filter = update_automoderator_filter_matches(
+                        queried_filter_and_index["filter"],
+                        matches_to_add,
+                        matches_to_remove
+                    )
+                    automod_filters[queried_filter_and_index["index"]] = updated_filter
+                    updated_automod_filters = user_preferences.FilterSeparator.join(automod_filters)
+                    await _acquire_rate_budget(constants.RedditRequestPriority.INTERACTIVE)
+                    await automod_config["wikipage"].edit(content=updated_automod_filters,
+                                                          reason=synced_filter["filter_log_reason"])
+                    # The edit creates a new revision, which is recorded so the next batch does not download the page
+                    # If someone else has edited the page since, its content is unknown so it is downloaded next time
+                    latest_revision = await _get_latest_wiki_revision(automod_config["wikipage"])
+                    if _is_own_wiki_revision(latest_revision, synced_filter["filter_log_reason"]):
+                        automod_config_cache[subreddit_name.lower()] = {
+                            "revision_id": latest_revision["id"],
+                            "content_md": updated_automod_filters
+                        }
+                    else:
+                        automod_config_cache.pop(subreddit_name.lower(), None)
+                    return constants.RedditAutomodEditStatus.SUCCESS.value
+                except exceptions.AutomodRemovalNotFound:
+                    return constants.RedditAutomodEditStatus.FAIL.value
+        return constants.RedditAutomodEditStatus.FAIL.value
     return constants.RedditAutomodEditStatus.MISSING_PRIVILEGES.value
 
 
@@ -331,36 +705,61 @@ def get_automoderator_filter(automod_filters, filter_name):
 
 
 # TODO: Refactor to generalize and get matches, even if form is not in an array with brackets []
-# Returns updated filter with new matches
-def update_automoderator_filter_matches(automod_filter, new_match, action):
+# Returns updated filter with the matches to remove taken out and the new matches added
+def update_automoderator_filter_matches(automod_filter, matches_to_add, matches_to_remove):
     # Find list of matches (e.g. list of names for shadowbans) between brackets
     matches = re.search(r"\[(.*)\]", automod_filter).group(1)
-    if action == constants.RedditOperationTypes.ADD.value:
-        matches += ", {}".format(new_match)
-    elif action == constants.RedditOperationTypes.REMOVE.value:
-        search_string = r"\,?\s*" + re.escape(new_match)
+    for match_to_remove in matches_to_remove:
+        search_string = r"\,?\s*" + re.escape(match_to_remove)
         search_result = re.search(search_string, matches)
+        if search_result is None:
+            raise exceptions.AutomodRemovalNotFound
 
         partitioned_matches = matches.partition(search_result.group())
-        if partitioned_matches[1] != "":
-            prefix = partitioned_matches[0]
-            suffix = partitioned_matches[2]
-            matches = prefix + suffix
-
-            # If we are removing the first entry in the list, ensure there is no extra comma at the beginning
-            if matches[0] == ",":
-                matches = matches[1:].lstrip()
-        else:
-            raise exceptions.AutomodRemovalNotFound
+        prefix = partitioned_matches[0]
+        suffix = partitioned_matches[2]
+        matches = prefix + suffix
+
+        # If we are removing the first entry in the list, ensure there is no extra comma at the beginning
+        if matches[:1] == ",":
+            matches = matches[1:].lstrip()
+    for new_match in matches_to_add:
+        matches = "{}, {}".format(matches, new_match) if matches.strip() != "" else new_match
     # Re-add brackets since they are removed via search
     matches = "[{}]".format(matches)
 
-    new_filter = re.sub(r"\[(.*)\]", matches, automod_filter)
+    # The replacement is given as a function so that backslashes in matches are not treated as escapes
+    new_filter = re.sub(r"\[(.*)\]", lambda bracketed_matches: matches, automod_filter)
     return new_filter
 
 
-async def action_on_post(post_id, action, post_type):
-    post_instance = await request_post(post_id, post_type)
+# Automatic actions taken while processing new posts should pass a lower priority than moderator-triggered actions
+# Queues the action on the post and waits for it to be taken
+async def action_on_post(post_id, action, post_type, priority=constants.RedditRequestPriority.INTERACTIVE):
+    # The future is shared with every request coalesced onto it, so cancelling this wait must not cancel the action
+    await asyncio.shield(enqueue_mod_action(post_id, action, post_type, priority))
+
+
+# Queues the action on the post without waiting for it, returning a future that resolves once the action is taken
+def enqueue_mod_action(post_id, action, post_type, priority=constants.RedditRequestPriority.INTERACTIVE):
+    return mod_action_queue.enqueue(get_post_fullname(post_id, post_type), action, post_id, post_type, priority)
+
+
+# Queues the same action on each of the given entry objects without waiting for them
+def enqueue_mod_actions(entry_objects, action, priority=constants.RedditRequestPriority.INTERACTIVE):
+    return [enqueue_mod_action(entry_object["_id"], action, entry_object["post_type"], priority)
+            for entry_object in entry_objects]
+
+
+# Moderator actions only need the post's ID, so the post is not fetched before acting on it
+def _get_lazy_post(post_id, post_type):
+    if post_type == constants.PostTypes.REDDIT_SUBMISSION.value:
+        return praw.models.Submission(reddit, id=post_id)
+    return praw.models.Comment(reddit, id=post_id)
+
+
+async def _action_on_post_instance(post_instance, action, priority):
+    await _acquire_rate_budget(priority)
     if action == constants.RedditOperationTypes.APPROVE.value:
         await post_instance.mod.approve()
     elif action == constants.RedditOperationTypes.REMOVE.value:
@@ -371,23 +770,66 @@ async def action_on_post(post_id, action, post_type):
         await post_instance.mod.unlock()
 
 
+def _get_history_scan_semaphore():
+    global history_scan_semaphore
+    if history_scan_semaphore is None:
+        history_scan_semaphore = asyncio.Semaphore(user_preferences.BotConsts.HISTORY_SCAN_CONCURRENCY.value)
+    return history_scan_semaphore
+
+
+# Returns details of the post author's activity in a blacklisted subreddit, or an empty object if there is none
 async def scan_user_history(post):
+    if len(blacklisted_subreddits) == 0:
+        return {}
     username = post["author"]["username"]
-    redditor = await reddit.redditor(username)
-    await redditor.load()
-    submissions = redditor.new()
-    async for submission in submissions:
-        post_subreddit = submission.subreddit.display_name
-        for subreddit in user_preferences.BlacklistedSubreddits:
-            if post_subreddit.lower() == subreddit.lower():
-                post_object = {
-                    "_id": submission.id,
-                    "infracting_subreddit": subreddit,
-                    "username": submission.author.name,
-                    "permalink": wrangler.generated_reddit_permalink(submission.permalink)
+    return await user_history_verdict_cache.get_or_load(
+        username.lower(), lambda: _scan_user_history_since_mark(username))
+
+
+# Scans the user's history that is newer than the last item scanned for them, keeping the previous verdict if nothing
+#   newer is in a blacklisted subreddit. A scan of the full history starts from an empty verdict
+async def _scan_user_history_since_mark(username):
+    async with _get_history_scan_semaphore():
+        scan_mark = user_history_scan_marks.get(username.lower())
+        last_scanned_item = None
+        verdict = {}
+        full_scan_time = time.monotonic()
+        if scan_mark is not None and scan_mark["last_item"] is not None and \
+                full_scan_time - scan_mark["full_scan_time"] < \
+                user_preferences.BotConsts.HISTORY_SCAN_FULL_RESCAN_INTERVAL.value:
+            last_scanned_item = scan_mark["last_item"]
+            verdict = scan_mark["verdict"]
+            full_scan_time = scan_mark["full_scan_time"]
+        try:
+            redditor = await get_loaded_redditor(username, constants.RedditRequestPriority.BACKGROUND)
+            await _acquire_rate_budget(constants.RedditRequestPriority.BACKGROUND)
+            params = {"before": last_scanned_item} if last_scanned_item is not None else None
+            history = await _convert_listing_generator_to_list(redditor.new(params=params))
+        except (asyncprawcore.exceptions.NotFound, asyncprawcore.exceptions.Forbidden):
+            return {}
+
+        # The listing can continue past the last scanned item, which (along with anything older) was already scanned
+        history_item_names = [item.name for item in history]
+        if last_scanned_item in history_item_names:
+            history = history[:history_item_names.index(last_scanned_item)]
+
+        for item in history:
+            blacklisted_subreddit = blacklisted_subreddits.get(item.subreddit.display_name.lower())
+            if blacklisted_subreddit is not None:
+                verdict = {
+                    "_id": item.id,
+                    "infracting_subreddit": blacklisted_subreddit,
+                    "username": item.author.name,
+                    "permalink": wrangler.generated_reddit_permalink(item.permalink)
                 }
-                return post_object
-    return {}
+                break
+
+        # If nothing newer was found, the last scanned item may have been deleted (which also empties the listing), so
+        #   the next scan reads the full history again
+        newest_item = history[0].name if len(history) > 0 else None
+        user_history_scan_marks.set(
+            username.lower(), {"last_item": newest_item, "verdict": verdict, "full_scan_time": full_scan_time})
+        return verdict
 
 
 async def iterate_through_reports(gen):
@@ -401,6 +843,7 @@ async def iterate_through_reports(gen):
 async def fetch_reported_posts(subreddit_moderation, post_type):
     reported_content = []
     post_type_param = "submissions" if post_type == constants.PostTypes.REDDIT_SUBMISSION.value else "comments"
+    await _acquire_rate_budget(constants.RedditRequestPriority.INGESTION)
     reports_generator = subreddit_moderation.reports(only=post_type_param)
     async for report in reports_generator:
         reported_content.append(report)
@@ -410,10 +853,10 @@ async def fetch_reported_posts(subreddit_moderation, post_type):
 async def fetch_latest_reports(subreddit_name):
     subreddit = await reddit.subreddit(subreddit_name)
     subreddit_moderation = subreddit.mod
-    comment_reports = await fetch_reported_posts(
-        subreddit_moderation, constants.PostTypes.REDDIT_COMMENT.value)
-    submission_reports = await fetch_reported_posts(
-        subreddit_moderation, constants.PostTypes.REDDIT_SUBMISSION.value)
+    comment_reports, submission_reports = await asyncio.gather(
+        fetch_reported_posts(subreddit_moderation, constants.PostTypes.REDDIT_COMMENT.value),
+        fetch_reported_posts(subreddit_moderation, constants.PostTypes.REDDIT_SUBMISSION.value)
+    )
 
     cleaned_reported_comments = await _clean_reported_content(
         comment_reports, constants.PostTypes.REDDIT_COMMENT.value)
@@ -28,7 +28,8 @@ base_filter = {
     "parent": "",
     "description": "Sample filter to create collection. You can delete this filter once you have at least one in the collection.",
     "matches": [],
-    "roles_to_ping": []
+    "roles_to_ping": [],
+    "short_circuit": False
 }
 comments.insert_one(null_object)
 filters.insert_one(base_filter)
@@ -19,6 +19,8 @@ from classes import SubredditAndChannels
 #   array of CIDs to send bot debug info to,
 #   hex code of embed colour,
 #   boolean flag whether bot has moderator access to subreddit,
+#   (optional) minutes between polls of this subreddit, defaults to BotConsts.POLL_TIMER,
+#   (optional) boolean flag whether to also stream new posts and comments as they arrive instead of waiting for polls,
 # )
 
 # e.g. ProdSubredditsAndChannels = [SubredditAndChannels("food", [12345], [12345, 78901], [], [], [78901], [12345], 0x000000, False)]
@@ -29,6 +31,10 @@ ProdSubredditsAndChannels = []
 # When you create any regex filters, add the names of the filters here (as strings) so that regex phrases get validated
 RegexFilters = []
 
+# Users and media source filters listed here (by name) match regardless of case, e.g. "SomeUser" also matches "someuser"
+#   Does not apply to filters in RegexFilters
+CaseInsensitiveFilters = []
+
 
 class Settings(Enum):
     # Bot prefix for commands
@@ -37,9 +43,52 @@ class Settings(Enum):
     BOT_SECONDARY_REVIEW_ROLE = "Secondary_Review"
 
 
-# Time in minutes before bot subsequently polls for new posts
+# Time in minutes before bot subsequently polls for new posts (can be overridden per subreddit)
 class BotConsts(Enum):
     POLL_TIMER = 5.0
+    # Time in minutes between reloads of filters from the database, shared by every subreddit's polling loop
+    FILTER_REFRESH_TIMER = 5.0
+    # If polling a subreddit fails, time in minutes before retrying, doubled on each consecutive failure up to the max
+    POLL_RESTART_BACKOFF = 0.5
+    POLL_RESTART_BACKOFF_MAX = 15.0
+    # If enabled, the time between polls of each subreddit adapts to how many new posts it has (starting from its poll
+    #   timer), shortening when polls return a full chunk of posts and lengthening when they return none
+    ADAPTIVE_POLLING = False
+    MIN_POLL_TIMER = 1.0
+    MAX_POLL_TIMER = 15.0
+    # Maximum number of streamed posts or comments processed together for subreddits that use streaming
+    STREAM_BATCH_SIZE = 25
+    # Budget shared by every Reddit API request (Reddit allows 100 requests per minute for OAuth clients), and the number
+    #   of requests that can be made in a burst before requests are spaced out
+    REDDIT_REQUESTS_PER_MINUTE = 100
+    REDDIT_RATE_BUDGET_BURST = 30
+    # Time in seconds a user's blacklisted subreddit history scan is reused for, the number of users to remember scans
+    #   for, and the number of user histories scanned at the same time
+    HISTORY_SCAN_VERDICT_TTL = 3600
+    HISTORY_SCAN_CACHE_SIZE = 5000
+    HISTORY_SCAN_CONCURRENCY = 4
+    # Time in seconds before a user's full history is scanned again rather than only the history newer than their last scan
+    HISTORY_SCAN_FULL_RESCAN_INTERVAL = 86400
+    # Number of "load more comments" links expanded each time a negative comment tree is requested (requesting it again
+    #   expands more), and the minimum number of comments a link must hide to be expanded
+    COMMENT_TREE_REPLACE_MORE_LIMIT = 32
+    COMMENT_TREE_REPLACE_MORE_THRESHOLD = 0
+    # Number of submission comment trees to keep cached, and the time in seconds before a cached tree is fetched again
+    COMMENT_TREE_CACHE_SIZE = 20
+    COMMENT_TREE_CACHE_TTL = 600
+    # Maximum number of post authors loaded from Reddit at the same time when processing a batch of posts
+    AUTHOR_LOAD_CONCURRENCY = 8
+    # Number of redditor profiles to keep cached, and the time in seconds before a cached profile is reloaded
+    REDDITOR_CACHE_SIZE = 2000
+    REDDITOR_CACHE_TTL = 600
+    # Number of posts requested per page when catching up on posts missed during downtime (Reddit allows at most 100)
+    CATCH_UP_PAGE_SIZE = 100
+    # Maximum number of listings (one per subreddit and post type) queried at the same time
+    POLL_CONCURRENCY = 4
+    # Number of moderator actions (approve, remove, lock, unlock) sent to Reddit at the same time
+    MOD_ACTION_WORKERS = 2
+    # Minutes past a media source history filter's cooldown after which a title is forgotten (None keeps titles forever)
+    MEDIA_HISTORY_EXPIRY = None
 
 
 BlacklistedSubreddits = []
@@ -68,3 +117,17 @@ FilterSeparator = "---"
 
 SENTIMENT_ANALYSIS_ENABLED = False
 SENTIMENT_ANALYSIS_NEGATIVE_THRESHOLD = 0.50
+# Number of posts classified together, and the maximum number of tokens of each post that are classified (None uses the
+#   longest input the model accepts)
+SENTIMENT_ANALYSIS_BATCH_SIZE = 16
+SENTIMENT_ANALYSIS_MAX_LENGTH = None
+# Sentiment analysis runs on a separate thread using at most SENTIMENT_ANALYSIS_TORCH_THREADS CPU threads. At most
+#   SENTIMENT_ANALYSIS_QUEUE_SIZE batches of posts wait for it at once, and a batch that is not classified within
+#   SENTIMENT_ANALYSIS_TIMEOUT seconds is skipped
+SENTIMENT_ANALYSIS_TORCH_THREADS = 2
+SENTIMENT_ANALYSIS_QUEUE_SIZE = 8
+SENTIMENT_ANALYSIS_TIMEOUT = 120
+# Number of classified texts whose results are kept so repeated text is not classified again, and an optional SQLite
+#   file path (e.g. "sentiment_cache.sqlite3") to also save results to so they are kept when the bot restarts
+SENTIMENT_ANALYSIS_CACHE_SIZE = 10000
+SENTIMENT_ANALYSIS_CACHE_FILE = None
@@ -364,15 +364,21 @@ def construct_user_not_found_embed(username):
     return embed
 
 
-def construct_negative_comment_tree_embed(submission, comments):
+def construct_negative_comment_tree_embed(submission, negative_comment_tree):
     embed = discord.Embed(
         title=submission.title,
         colour=discord.Colour(constants.RedditEmbedConsts.post_colour.value),
         url=generated_reddit_permalink(submission.permalink)
     )
     embed.set_author(name="Negative Comment Tree")
-
-    for comment in comments:
+    scan_summary = constants.StringConstants.NEGATIVE_COMMENT_TREE_SCANNED.value.format(
+        negative_comment_tree["num_scanned"], negative_comment_tree["num_total"])
+    if negative_comment_tree["num_unexpanded"] > 0:
+        scan_summary += constants.StringConstants.NEGATIVE_COMMENT_TREE_UNEXPANDED.value.format(
+            negative_comment_tree["num_unexpanded"])
+    embed.set_footer(text=scan_summary)
+
+    for comment in negative_comment_tree["comments"]:
         author = comment.author.name
         author_link = constants.RedditEmbedConsts.username_link.value + author
         comment_link = generated_reddit_permalink(comment.permalink)